@@ -0,0 +1,171 @@
+"""Версии кэшируемых данных и кэш готовых ответов API.
+
+Версия - момент последнего изменения данных (time.time()). Её меняют
+сигналы моделей, поэтому ключи со старой версией просто перестают
+использоваться и вытесняются из кэша сами. Версии хранятся в кэше
+versions, который не вытесняет их вместе с ответами.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.db.models import Max
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from reviews.models import ShoppingList
+
+VERSION_KEY = 'version:{}'
+
+
+def get_version(name):
+    """Текущая версия данных; если её нет в кэше, начинается новая."""
+    versions = caches['versions']
+    version = versions.get(VERSION_KEY.format(name))
+    if version is None:
+        version = time.time()
+        if not versions.add(VERSION_KEY.format(name), version, None):
+            version = versions.get(VERSION_KEY.format(name), version)
+    return version
+
+
+def bump_version(*names):
+    version = time.time()
+    caches['versions'].set_many(
+        {VERSION_KEY.format(name): version for name in names}, None)
+
+
+def bump_cart_versions(recipe_ids):
+    """Состав рецептов изменился: меняются списки покупок с ними."""
+    user_ids = ShoppingList.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('user_id', flat=True).distinct()
+    bump_version(*(f'cart:{user_id}' for user_id in user_ids))
+
+
+def make_etag(*parts):
+    """Сильный ETag из частей, которые определяют содержимое ответа."""
+    digest = hashlib.sha1(
+        '|'.join(map(str, parts)).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+
+def set_conditional_headers(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def stream_to_cache(chunks, key):
+    """Отдаёт куски ответа дальше и кладёт их в кэш, когда они кончатся."""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(parts))
+
+
+def get_not_modified_response(request, etag, last_modified=None):
+    """304, если у клиента актуальная версия ответа, иначе None.
+
+    last_modified - timestamp; If-None-Match важнее If-Modified-Since.
+    """
+    response = get_conditional_response(
+        request, etag=etag,
+        last_modified=None if last_modified is None else int(last_modified)
+    )
+    if response is not None:
+        set_conditional_headers(response, etag, last_modified)
+    return response
+
+
+class VersionedCacheMixin:
+    """Отдаёт list и retrieve готовыми байтами из кэша, с ETag.
+
+    cache_version - имя версии, которую меняют сигналы при изменении
+    данных вьюсета. Пока версия не изменилась, база не запрашивается,
+    а на If-None-Match с тем же ETag отвечает 304.
+    """
+
+    cache_version = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+    def get_cached_response(self, request, view, *args, **kwargs):
+        version = get_version(self.cache_version)
+        etag = make_etag(self.cache_version, version, request.get_full_path())
+        response = get_not_modified_response(request, etag)
+        if response is not None:
+            return response
+        key = f'response:{etag}'
+        content = cache.get(key)
+        if content is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            cache.set(key, content)
+        return set_conditional_headers(
+            HttpResponse(content, content_type='application/json'), etag)
+
+
+class ConditionalRecipeMixin:
+    """ETag и Last-Modified для list и retrieve рецептов.
+
+    Свежесть проверяется запросом MAX(updated_at) и версиями из кэша,
+    без сериализации и без COUNT(*): появление и удаление рецептов
+    отслеживает версия recipes, переименования тегов и ингредиентов -
+    их версии. В ответ входят флаги текущего
+    пользователя, поэтому в ETag попадает версия его избранного,
+    списка покупок и подписок.
+    """
+
+    def get_freshness_parts(self, request):
+        user = request.user
+        versions = [get_version(name)
+                    for name in ('recipes', 'tags', 'ingredients')]
+        if user.is_authenticated:
+            versions.append(get_version(f'user:{user.pk}'))
+        return user.pk, versions
+
+    def get_conditional_response(self, request, queryset, view, *args,
+                                 **kwargs):
+        updated_at = queryset.order_by().aggregate(
+            updated_at=Max('updated_at'))['updated_at']
+        user_id, versions = self.get_freshness_parts(request)
+        last_modified = max(
+            [*versions, *([updated_at.timestamp()] if updated_at else [])])
+        etag = make_etag(
+            request.get_full_path(), user_id, *versions, updated_at)
+        response = get_not_modified_response(request, etag, last_modified)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                set_conditional_headers(response, etag, last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            request, self.filter_queryset(self.get_queryset()),
+            super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.get_queryset().filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        return self.get_conditional_response(
+            request, queryset, super().retrieve, *args, **kwargs)
@@ -1,2 +1,5 @@
 MIN = 1
 MAX = 32000
+MAX_BATCH = 100
+MAX_AUTHORS_BATCH = 500
+UPLOAD_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
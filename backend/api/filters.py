@@ -2,6 +2,7 @@ from django_filters.rest_framework import filters
 from django_filters.rest_framework import FilterSet
 
 from reviews.models import Recipe, Ingredient, Tag
+from reviews.search import search_recipes
 
 
 class IngredientFilter(FilterSet):
@@ -26,17 +27,22 @@ class RecipeFilter(FilterSet):
         method='filter_by_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_by_shopping_cart')
+    search = filters.CharFilter(method='filter_by_search')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
 
     def filter_by_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shopping_list__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
     def filter_by_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
+
+    def filter_by_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
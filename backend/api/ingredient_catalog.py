@@ -0,0 +1,37 @@
+"""Справочник ингредиентов в памяти процесса.
+
+Ингредиентов немного и меняются они редко, поэтому каждый воркер держит
+словарь id -> (название, единица измерения) и перечитывает его, только
+когда сигналы сменили версию ingredients.
+"""
+import threading
+
+from reviews.models import Ingredient
+
+from .cache import get_version
+
+
+class IngredientCatalog:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._items = {}
+
+    def snapshot(self):
+        """Актуальный словарь; проверка версии - один запрос к кэшу."""
+        version = get_version('ingredients')
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._items = {
+                        pk: (name, measurement_unit)
+                        for pk, name, measurement_unit
+                        in Ingredient.objects.values_list(
+                            'pk', 'name', 'measurement_unit').iterator()
+                    }
+                    self._version = version
+        return self._items
+
+
+ingredient_catalog = IngredientCatalog()
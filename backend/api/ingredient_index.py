@@ -0,0 +1,142 @@
+"""Префиксный индекс ингредиентов в файле, отображённом в память.
+
+Файл строится из таблицы ингредиентов и открывается через mmap, поэтому
+все процессы gunicorn делят одни и те же страницы памяти. Записи
+отсортированы по ключу поиска, префикс ищется двоичным поиском.
+
+Формат файла: заголовок (MAGIC, количество записей), таблица смещений
+записей (uint32) и сами записи: ключ, id, название и единица измерения.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from django.conf import settings
+
+from reviews.models import Ingredient
+
+MAGIC = b'FGI1'
+HEADER = struct.Struct('<4sI')
+OFFSET = struct.Struct('<I')
+STRING_LENGTH = struct.Struct('<H')
+ID = struct.Struct('<Q')
+
+
+def normalize(value):
+    """Ключ поиска: без учёта регистра, «ё» не отличается от «е»."""
+    return value.casefold().replace('ё', 'е')
+
+
+def _pack_string(value):
+    encoded = value.encode('utf-8')
+    return STRING_LENGTH.pack(len(encoded)) + encoded
+
+
+def build_index(path=None):
+    """Строит файл индекса и атомарно подменяет им старый."""
+    path = os.fspath(path or settings.INGREDIENT_INDEX_PATH)
+    rows = sorted(
+        (normalize(name), name, pk, measurement_unit)
+        for pk, name, measurement_unit in Ingredient.objects.order_by(
+        ).values_list('id', 'name', 'measurement_unit')
+    )
+    records = [
+        _pack_string(key) + ID.pack(pk) + _pack_string(name)
+        + _pack_string(measurement_unit)
+        for key, name, pk, measurement_unit in rows
+    ]
+    offset = HEADER.size + OFFSET.size * len(records)
+    offsets = []
+    for record in records:
+        offsets.append(OFFSET.pack(offset))
+        offset += len(record)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(records)))
+            file.writelines(offsets)
+            file.writelines(records)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class IngredientIndex:
+    """Доступ к индексу; файл переоткрывается, когда его перестроили."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._map = None
+        self._stat = None
+        self._count = 0
+
+    def _read_string(self, position):
+        (length,) = STRING_LENGTH.unpack_from(self._map, position)
+        position += STRING_LENGTH.size
+        return self._map[position:position + length], position + length
+
+    def _key_at(self, index):
+        (offset,) = OFFSET.unpack_from(
+            self._map, HEADER.size + index * OFFSET.size)
+        return self._read_string(offset)
+
+    def _open(self):
+        path = os.fspath(settings.INGREDIENT_INDEX_PATH)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            build_index(path)
+            stat = os.stat(path)
+        signature = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._stat:
+            return
+        with open(path, 'rb') as file:
+            index_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(index_map)
+        if magic != MAGIC:
+            index_map.close()
+            raise ValueError(f'{path} не является индексом ингредиентов.')
+        if self._map is not None:
+            self._map.close()
+        self._map, self._stat, self._count = index_map, signature, count
+
+    def _lower_bound(self, prefix):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle)[0] < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix."""
+        prefix = normalize(prefix).encode('utf-8')
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        results = []
+        with self._lock:
+            self._open()
+            index = self._lower_bound(prefix)
+            while index < self._count and len(results) < limit:
+                key, position = self._key_at(index)
+                if not key.startswith(prefix):
+                    break
+                (pk,) = ID.unpack_from(self._map, position)
+                name, position = self._read_string(position + ID.size)
+                measurement_unit, _ = self._read_string(position)
+                results.append({
+                    'id': pk,
+                    'name': name.decode('utf-8'),
+                    'measurement_unit': measurement_unit.decode('utf-8'),
+                })
+                index += 1
+        return results
+
+
+ingredient_index = IngredientIndex()
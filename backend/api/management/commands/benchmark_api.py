@@ -0,0 +1,409 @@
+import itertools
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from reviews.constants import PLACEHOLDER_IMAGE
+from reviews.cart import rebuild_cart_totals
+from reviews.counters import reconcile_counters
+from reviews.models import (Favorite, Ingredient, IngredientRecipes, Recipe,
+                            ShoppingList, Tag)
+from users.models import Follow, User
+
+BUDGETS_PATH = Path(settings.BASE_DIR) / 'data' / 'benchmark_budgets.json'
+CALIBRATION_RUNS = 20
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': alias}
+    for alias in ('default', 'versions')
+}
+
+
+def load_budgets(path=BUDGETS_PATH):
+    """Бюджеты: имя случая -> {'queries': n, 'time': t}.
+
+    time - медиана времени ответа в единицах калибровки (см.
+    Command.calibrate), поэтому не зависит от скорости машины.
+    """
+    return json.loads(Path(path).read_text(encoding='utf-8'))
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет количество запросов и время ответа эндпоинтов API '
+        'на тестовой базе и сравнивает их с бюджетами. Время считается '
+        'относительно калибровочной нагрузки в том же процессе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=30)
+        parser.add_argument('--recipes', type=int, default=300)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Размер страницы в списках.')
+        parser.add_argument(
+            '--read-limit', type=int, default=100,
+            help='Размер страницы при сравнении путей чтения рецептов.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Сколько раз повторять каждый запрос.')
+        parser.add_argument(
+            '--time-factor', type=float, default=3.0,
+            help='Во сколько раз время может превысить бюджет.')
+        parser.add_argument('--budgets', default=str(BUDGETS_PATH))
+        parser.add_argument('--report', default='benchmark-report.json')
+        parser.add_argument('--update-budgets', action='store_true',
+                            help='Записать текущие замеры как бюджеты.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(
+                    MEDIA_ROOT=media_root,
+                    INGREDIENT_INDEX_PATH=Path(media_root) / 'ingredients.idx',
+                    CACHES=LOCMEM_CACHES
+                ):
+                    data = self.seed(options)
+                    calibration = self.calibrate(options)
+                    results = self.run_cases(data, options)
+                    read_paths = self.compare_read_paths(data, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.check_budgets(results, read_paths, calibration, options)
+
+    def seed(self, options):
+        """Заполняет тестовую базу данными, похожими на боевые."""
+        User.objects.bulk_create(
+            User(email=f'user{index}@example.com', username=f'user{index}',
+                 first_name='Имя', last_name='Фамилия')
+            for index in range(options['users'])
+        )
+        users = list(User.objects.order_by('id'))
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (('Завтрак', '#423189', 'breakfast'),
+                                      ('Обед', '#ED760E', 'lunch'),
+                                      ('Ужин', '#47A76A', 'dinner'))
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+            for index in range(200)
+        )
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+        image = Recipe.image.field.storage.save(
+            'recipes/pixel.png', ContentFile(PLACEHOLDER_IMAGE))
+        Recipe.objects.bulk_create(
+            Recipe(author=users[index % len(users)], name=f'Рецепт {index}',
+                   text='Описание рецепта', cooking_time=index % 120 + 1,
+                   image=image)
+            for index in range(options['recipes'])
+        )
+        recipes = list(Recipe.objects.order_by('id'))
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tags[index % len(tags)])
+            for index, recipe in enumerate(recipes)
+        )
+        per_recipe = options['ingredients_per_recipe']
+        IngredientRecipes.objects.bulk_create(
+            IngredientRecipes(
+                recipe=recipe,
+                ingredient_id=ingredient_ids[
+                    (index + step * 7) % len(ingredient_ids)],
+                amount=step + 1
+            )
+            for index, recipe in enumerate(recipes)
+            for step in range(per_recipe)
+        )
+        user = users[0]
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=recipe) for recipe in recipes[::3])
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=user, recipe=recipe) for recipe in recipes[::5])
+        Follow.objects.bulk_create(
+            Follow(user=user, author=author) for author in users[1::2])
+        reconcile_counters()
+        rebuild_cart_totals()
+        return {
+            'user': user,
+            'other': users[2],
+            'tags': tags,
+            'ingredient': ingredient_ids[0],
+            'recipe': recipes[-1],
+            'free_recipe': recipes[1],
+            # Не в избранном и не в списке покупок (индексы 1 mod 15).
+            'batch_recipes': [recipe.pk for recipe in recipes[1::15][:20]],
+            # Ещё не в подписках и не совпадают с other.
+            'batch_authors': [author.pk for author in users[4::2]],
+        }
+
+    def get_cases(self, data, limit):
+        """Запросы ко всем маршрутам api/urls.py."""
+        recipe = data['recipe'].pk
+        free_recipe = data['free_recipe'].pk
+        other = data['other'].pk
+        filters = {
+            'tags': f'tags={data["tags"][0].slug}&tags={data["tags"][1].slug}',
+            'author': f'author={data["user"].pk}',
+            'is_favorited': 'is_favorited=1',
+            'is_in_shopping_cart': 'is_in_shopping_cart=1',
+        }
+        cases = [
+            ('recipes anonymous', 'get', f'/api/recipes/?limit={limit}',
+             False),
+            ('recipe detail anonymous', 'get', f'/api/recipes/{recipe}/',
+             False),
+            ('recipe detail', 'get', f'/api/recipes/{recipe}/', True),
+        ]
+        for size in range(len(filters) + 1):
+            for combination in itertools.combinations(filters, size):
+                query = '&'.join(filters[name] for name in combination)
+                cases.append((
+                    'recipes ' + ('+'.join(combination) or 'unfiltered'),
+                    'get', f'/api/recipes/?limit={limit}&{query}', True
+                ))
+        cases += [
+            ('recipes cursor', 'get', f'/api/recipes/?limit={limit}&cursor=',
+             True),
+            ('recipes search', 'get',
+             f'/api/recipes/?limit={limit}&search=рецепт', True),
+            ('recipes search+all filters', 'get',
+             f'/api/recipes/?limit={limit}&search=рецепт&'
+             + '&'.join(filters.values()), True),
+            ('ingredients', 'get', '/api/ingredients/', False),
+            ('ingredients search', 'get', '/api/ingredients/?name=ингр',
+             False),
+            ('ingredient detail', 'get',
+             f'/api/ingredients/{data["ingredient"]}/', False),
+            ('tags', 'get', '/api/tags/', False),
+            ('tag detail', 'get', f'/api/tags/{data["tags"][0].pk}/', False),
+            ('users', 'get', f'/api/users/?limit={limit}', True),
+            ('user detail', 'get', f'/api/users/{other}/', True),
+            ('users me', 'get', '/api/users/me/', True),
+            ('subscriptions', 'get',
+             f'/api/users/subscriptions/?limit={limit}', True),
+            ('subscriptions recipes_limit', 'get',
+             f'/api/users/subscriptions/?limit={limit}&recipes_limit=3',
+             True),
+            ('subscriptions cursor', 'get',
+             f'/api/users/subscriptions/?limit={limit}&cursor=', True),
+            ('subscribe', 'post', f'/api/users/{other}/subscribe/', True),
+            ('unsubscribe', 'delete', f'/api/users/{other}/subscribe/',
+             True),
+            ('favorite', 'post', f'/api/recipes/{free_recipe}/favorite/',
+             True),
+            ('unfavorite', 'delete',
+             f'/api/recipes/{free_recipe}/favorite/', True),
+            ('shopping_cart', 'post',
+             f'/api/recipes/{free_recipe}/shopping_cart/', True),
+            ('shopping_cart delete', 'delete',
+             f'/api/recipes/{free_recipe}/shopping_cart/', True),
+            ('download_shopping_cart', 'get',
+             '/api/recipes/download_shopping_cart/', True),
+        ]
+        batch = {'recipes': data['batch_recipes']}
+        for name in ('favorite', 'shopping_cart'):
+            cases += [
+                (f'{name} batch', 'post', f'/api/recipes/{name}/', True,
+                 batch),
+                (f'{name} batch delete', 'delete', f'/api/recipes/{name}/',
+                 True, batch),
+            ]
+        batch = {'authors': data['batch_authors']}
+        cases += [
+            ('subscribe batch', 'post', '/api/users/subscribe/', True, batch),
+            ('unsubscribe batch', 'delete', '/api/users/subscribe/', True,
+             batch),
+        ]
+        return cases
+
+    def calibrate(self, options):
+        """Медиана калибровочной нагрузки в мс - единица времени бюджетов.
+
+        Нагрузка не проходит через код API: те же запросы к базе и
+        сериализация JSON, что и у типичного списка, поэтому замедление
+        машины или базы меняет её так же, как ответы эндпоинтов, а
+        регрессия в API - нет.
+        """
+        timings = []
+        for _ in range(max(options['repeat'], CALIBRATION_RUNS)):
+            start = time.perf_counter()
+            rows = list(Recipe.objects.values(
+                'id', 'name', 'text', 'cooking_time', 'author__username'
+            ).order_by('-id')[:options['limit']])
+            ingredients = list(IngredientRecipes.objects.filter(
+                recipe_id__in=[row['id'] for row in rows]
+            ).values('recipe_id', 'ingredient__name', 'amount'))
+            json.dumps({'results': rows, 'ingredients': ingredients},
+                       ensure_ascii=False)
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings) * 1000
+
+    def measure(self, client, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        return response.status_code, len(queries), elapsed * 1000
+
+    def run_cases(self, data, options):
+        anonymous = APIClient()
+        client = APIClient()
+        client.force_authenticate(data['user'])
+        results = {}
+        cases = self.get_cases(data, options['limit'])
+        # Мутирующие запросы идут парами, поэтому повторяем их группой.
+        for _ in range(options['repeat']):
+            for name, method, url, authenticated, *data in cases:
+                status, queries, elapsed = self.measure(
+                    client if authenticated else anonymous, method, url,
+                    *data)
+                result = results.setdefault(name, {
+                    'method': method.upper(), 'url': url,
+                    'status': status, 'queries': queries, 'timings': []
+                })
+                result['queries'] = max(result['queries'], queries)
+                result['timings'].append(elapsed)
+        for result in results.values():
+            timings = result.pop('timings')
+            result['time_ms'] = round(statistics.median(timings), 3)
+        return results
+
+    def compare_read_paths(self, data, options):
+        """Сравнивает ответы рецептов через values() и через сериализатор.
+
+        Ответы обоих путей должны совпадать байт в байт; для каждого
+        запроса считается медиана времени и прирост пропускной
+        способности быстрого пути.
+        """
+        anonymous = APIClient()
+        client = APIClient()
+        client.force_authenticate(data['user'])
+        page = f'/api/recipes/?limit={options["read_limit"]}'
+        urls = (
+            page,
+            f'{page}&cursor=',
+            f'{page}&tags={data["tags"][0].slug}&is_favorited=1',
+            f'{page}&search=рецепт',
+            f'/api/recipes/{data["recipe"].pk}/',
+        )
+        results = {}
+        for url in urls:
+            for name, api_client in (('anonymous', anonymous),
+                                     ('user', client)):
+                contents, timings = {}, {}
+                for fast in (False, True):
+                    with override_settings(RECIPES_FAST_READ=fast):
+                        timings[fast] = []
+                        for _ in range(options['repeat']):
+                            start = time.perf_counter()
+                            response = api_client.get(url)
+                            timings[fast].append(
+                                time.perf_counter() - start)
+                        contents[fast] = (response.status_code,
+                                          response.content)
+                serializer, values = (
+                    statistics.median(timings[fast]) * 1000
+                    for fast in (False, True))
+                results[f'{url} {name}'] = {
+                    'identical': contents[False] == contents[True],
+                    'serializer_ms': round(serializer, 3),
+                    'values_ms': round(values, 3),
+                    'speedup': round(serializer / values, 2),
+                }
+        return results
+
+    def check_budgets(self, results, read_paths, calibration, options):
+        """Сверяет число запросов и время с бюджетами.
+
+        Время переводится в единицы калибровки и считается регрессией,
+        только если превышает бюджет больше чем в time_factor раз:
+        абсолютные миллисекунды зависят от машины, а отношение - нет.
+        """
+        budgets_path = Path(options['budgets'])
+        budgets = load_budgets(budgets_path) if budgets_path.exists() else {}
+        time_factor = options['time_factor']
+        failures = []
+        for name, result in results.items():
+            budget = budgets.get(name)
+            result['budget'] = budget
+            result['time'] = round(result['time_ms'] / calibration, 3)
+            result['time_ratio'] = (
+                round(result['time'] / budget['time'], 2)
+                if budget and budget.get('time') else None)
+            errors = []
+            if result['status'] >= 400:
+                errors.append(f'статус {result["status"]}')
+            if budget is not None and result['queries'] > budget['queries']:
+                errors.append(
+                    f'{result["queries"]} запросов '
+                    f'при бюджете {budget["queries"]}')
+            if (result['time_ratio'] is not None
+                    and result['time_ratio'] > time_factor):
+                errors.append(
+                    f'время x{result["time_ratio"]} от бюджета '
+                    f'(допустимо x{time_factor})')
+            result['ok'] = not errors
+            if errors:
+                failures.append(f'{name}: {", ".join(errors)}')
+            ratio = result['time_ratio']
+            self.stdout.write(
+                f'{name:52} {result["queries"]:4} запр. '
+                f'{result["time_ms"]:9.2f} мс '
+                + (f'x{ratio:.2f}' if ratio is not None else '')
+            )
+        for name, result in read_paths.items():
+            if not result['identical']:
+                failures.append(f'{name}: ответ через values() отличается')
+            self.stdout.write(
+                f'{name:52} {result["serializer_ms"]:9.2f} -> '
+                f'{result["values_ms"]:.2f} мс (x{result["speedup"]})'
+            )
+        self.stdout.write(f'Калибровка: {calibration:.3f} мс')
+        report = {
+            'created': timezone.now().isoformat(),
+            'options': {
+                key: options[key]
+                for key in ('users', 'recipes', 'ingredients_per_recipe',
+                            'limit', 'read_limit', 'repeat', 'time_factor')
+            },
+            'calibration_ms': round(calibration, 3),
+            'results': results,
+            'read_paths': read_paths,
+        }
+        Path(options['report']).write_text(
+            json.dumps(report, ensure_ascii=False, indent=2),
+            encoding='utf-8'
+        )
+        if options['update_budgets']:
+            budgets_path.write_text(json.dumps(
+                {
+                    name: {'queries': result['queries'],
+                           'time': result['time']}
+                    for name, result in results.items()
+                },
+                ensure_ascii=False, indent=2, sort_keys=True
+            ) + '\n', encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS('Бюджеты обновлены'))
+            return
+        if failures:
+            raise CommandError(
+                'Превышены бюджеты:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены'))
@@ -1,5 +1,221 @@
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import get_version, make_etag
+
+
+def estimate_count(queryset):
+    """Оценка числа строк планировщиком PostgreSQL.
+
+    queryset.explain() не подходит: psycopg2 разбирает колонку json
+    сам, и Django склеивает план обратно через str(), то есть не в JSON.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CachedCountPaginator(DjangoPaginator):
+    """Берёт count из кэша, а на больших выборках - из оценки планировщика.
+
+    count_key меняется вместе с версиями данных, поэтому устаревшее
+    значение не используется даже до истечения PAGINATION_COUNT_TTL.
+    """
+
+    def __init__(self, object_list, per_page, count_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        cached = cache.get(self.count_key) if self.count_key else None
+        if cached is not None:
+            count, self.count_exact = cached
+            return count
+        count = None
+        threshold = settings.PAGINATION_ESTIMATE_THRESHOLD
+        queryset = self.object_list
+        if (threshold and hasattr(queryset, 'explain')
+                and connections[queryset.db].vendor == 'postgresql'):
+            count = estimate_count(queryset)
+            self.count_exact = count <= threshold
+        if self.count_exact:
+            count = super().count
+        if self.count_key:
+            cache.set(self.count_key, (count, self.count_exact),
+                      settings.PAGINATION_COUNT_TTL)
+        return count
 
 
 class Paginator(pagination.PageNumberPagination):
+    """Постраничная пагинация с режимом курсора по ключу сортировки.
+
+    Режим курсора включается параметром cursor (пустым для первой
+    страницы), если у вьюсета задан keyset_ordering. Страница ищется
+    условием по ключу последней записи, без COUNT(*) и OFFSET, поэтому
+    глубокие страницы отдаются так же быстро, как первая.
+
+    В постраничном режиме count кэшируется по нормализованным фильтрам
+    и версии count_version вьюсета. Если в запросе есть параметры из
+    user_count_params вьюсета (или их список не задан), число зависит от
+    пользователя и в ключ попадают он сам и версия его данных.
+    """
+
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_ordering = getattr(view, 'keyset_ordering', None)
+        if (self.keyset_ordering
+                and self.cursor_query_param in request.query_params):
+            return self.paginate_keyset(queryset, request)
+        self.keyset_ordering = None
+        count_key = self.get_count_key(request, view)
+        self.django_paginator_class = (
+            lambda *args, **kwargs: CachedCountPaginator(
+                *args, count_key=count_key, **kwargs))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_key(self, request, view):
+        count_version = getattr(view, 'count_version', None)
+        if count_version is None:
+            return None
+        ignored = (self.page_query_param, self.page_size_query_param,
+                   self.cursor_query_param)
+        params = sorted(
+            (name, sorted(values))
+            for name, values in request.query_params.lists()
+            if name not in ignored
+        )
+        parts = [request.path, params, get_version(count_version)]
+        user = request.user
+        user_params = getattr(view, 'user_count_params', None)
+        if user.is_authenticated and (user_params is None or any(
+                request.query_params.get(name) for name in user_params)):
+            parts += [user.pk, get_version(f'user:{user.pk}')]
+        return f'count:{make_etag(*parts)}'
+
+    def get_paginated_response(self, data):
+        if not self.keyset_ordering:
+            return Response(OrderedDict((
+                ('count', self.page.paginator.count),
+                ('count_exact', self.page.paginator.count_exact),
+                ('next', self.get_next_link()),
+                ('previous', self.get_previous_link()),
+                ('results', data),
+            )))
+        return Response(OrderedDict((
+            ('next', self.get_keyset_link(self.next_position, False)),
+            ('previous', self.get_keyset_link(self.previous_position, True)),
+            ('results', data),
+        )))
+
+    def get_keyset_filter(self, position, reverse):
+        """Условие «после position» для сортировки keyset_ordering.
+
+        Для ('-pub_date', '-id'): pub_date <= p AND (pub_date < p OR
+        (pub_date = p AND id < i)). Граница по первому полю позволяет
+        базе читать индекс диапазоном.
+        """
+        condition, equal, bound = Q(), {}, None
+        for field, value in zip(self.keyset_ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            if bound is None:
+                bound = Q(**{f'{name}__{lookup}e': value})
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return bound & condition
+
+    def paginate_keyset(self, queryset, request):
+        self.request = request
+        self.base_url = remove_query_param(
+            request.build_absolute_uri(), self.page_query_param)
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(
+            request.query_params[self.cursor_query_param], queryset.model)
+        ordering = self.keyset_ordering
+        if reverse:
+            ordering = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(position, reverse))
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+        has_next = has_more if not reverse else position is not None
+        has_previous = position is not None if not reverse else has_more
+        self.next_position = (
+            self.get_position(results[-1]) if results and has_next else None)
+        self.previous_position = (
+            self.get_position(results[0])
+            if results and has_previous else None)
+        return results
+
+    def get_position(self, instance):
+        """Ключ сортировки объекта или строки values()."""
+        if isinstance(instance, dict):
+            return [
+                instance[field.lstrip('-')] for field in self.keyset_ordering]
+        return [
+            getattr(instance, field.lstrip('-'))
+            for field in self.keyset_ordering
+        ]
+
+    def get_keyset_link(self, position, reverse):
+        if position is None:
+            return None
+        token = urlsafe_b64encode(json.dumps(
+            {'p': position, 'r': reverse}, default=self.encode_value
+        ).encode('utf-8')).decode('ascii')
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, token)
+
+    @staticmethod
+    def encode_value(value):
+        """Даты целиком, с микросекундами, иначе курсор станет неточным."""
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        raise TypeError(f'{type(value).__name__} нельзя записать в курсор.')
+
+    def decode_cursor(self, token, model):
+        """Позиция и направление из курсора; пустой курсор - начало."""
+        if not token:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(token.encode('ascii')))
+            if len(cursor['p']) != len(self.keyset_ordering):
+                raise ValueError
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.keyset_ordering, cursor['p'])
+            ]
+            return position, bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,32 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import FileUploadParser
+
+
+class ImageUploadParser(FileUploadParser):
+    """Тело запроса - сам файл изображения.
+
+    Файл читается обработчиками загрузки Django: большой пишется
+    во временный файл по частям и не держится в памяти целиком.
+    Слишком большое тело отклоняется по Content-Length до чтения.
+    """
+
+    media_type = 'image/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        meta = parser_context['request'].META
+        try:
+            length = int(meta.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if length > max_size:
+            raise ParseError(
+                f'Размер изображения больше {max_size // (1024 * 1024)} МБ.')
+        return super().parse(stream, media_type, parser_context)
+
+    def get_filename(self, stream, media_type, parser_context):
+        filename = super().get_filename(stream, media_type, parser_context)
+        if filename:
+            return filename
+        return 'image.' + media_type.split(';')[0].rpartition('/')[2]
@@ -0,0 +1,144 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from rest_framework import relations, serializers
+
+from reviews.models import Recipe
+
+PrefetchPlan = namedtuple('PrefetchPlan', ('select_related', 'prefetch'))
+PrefetchPlan.__doc__ = """План загрузки связей для сериализатора.
+
+select_related - пути для JOIN, prefetch - кортежи
+(путь, модель, вложенный план) для отдельных запросов.
+"""
+
+
+def get_ordering_expressions(model):
+    """Выражения сортировки из Meta.ordering модели."""
+    return [
+        F(field[1:]).desc() if field.startswith('-') else F(field).asc()
+        for field in model._meta.ordering
+    ]
+
+
+def prefetch_limited_recipes(authors, recipes_limit=None):
+    """Загружает первые recipes_limit рецептов каждого автора одним запросом.
+
+    Рецепты нумеруются ROW_NUMBER() в пределах автора, поэтому выборка
+    не зависит от количества авторов на странице. Результат доступен в
+    атрибуте limited_recipes.
+    """
+    recipes = Recipe.objects.filter(
+        author_id__in=[author.pk for author in authors])
+    if recipes_limit is not None:
+        ranked = recipes.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=F('author_id'),
+            order_by=get_ordering_expressions(Recipe)
+        )).order_by().values('pk', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        recipes = recipes.filter(pk__in=RawSQL(
+            f'SELECT "ranked"."id" FROM ({sql}) AS "ranked" '
+            'WHERE "ranked"."row_number" <= %s',
+            (*params, recipes_limit)
+        ))
+    prefetch_related_objects(
+        authors,
+        Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+    )
+
+
+def _needs_object(field, is_last):
+    """Нужен ли полю сам связанный объект, а не только его pk."""
+    if not is_last:
+        return True
+    return not isinstance(field, relations.PrimaryKeyRelatedField)
+
+
+def _plan_field(model, field, bits, select_related, prefetch):
+    """Дополняет план связями, через которые читает одно поле."""
+    child = getattr(field, 'child', getattr(field, 'child_relation', field))
+    path = []
+    for index, bit in enumerate(bits):
+        try:
+            model_field = model._meta.get_field(bit)
+        except FieldDoesNotExist:
+            return
+        if not model_field.is_relation:
+            return
+        path.append(bit)
+        model = model_field.related_model
+        lookup = '__'.join(path)
+        if model_field.one_to_many or model_field.many_to_many:
+            prefetch.append((lookup, model, _plan_nested(
+                model, child, bits[index + 1:])))
+            return
+        if (_needs_object(child, index == len(bits) - 1)
+                and lookup not in select_related):
+            select_related.append(lookup)
+    if not path or not isinstance(child, serializers.BaseSerializer):
+        return
+    nested = _build_plan(child, model)
+    select_related.extend(
+        f'{lookup}__{related}' for related in nested.select_related)
+    prefetch.extend(
+        (f'{lookup}__{related}', related_model, plan)
+        for related, related_model, plan in nested.prefetch
+    )
+
+
+def _plan_nested(model, child, bits):
+    """План для queryset отдельного запроса Prefetch."""
+    if bits:
+        select_related, prefetch = [], []
+        _plan_field(model, child, bits, select_related, prefetch)
+        return PrefetchPlan(tuple(select_related), tuple(prefetch))
+    if isinstance(child, serializers.BaseSerializer):
+        return _build_plan(child, model)
+    return PrefetchPlan((), ())
+
+
+def _build_plan(serializer, model):
+    select_related, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        _plan_field(
+            model, field, field.source.split('.'), select_related, prefetch)
+    return PrefetchPlan(tuple(select_related), tuple(prefetch))
+
+
+@lru_cache(maxsize=None)
+def get_prefetch_plan(serializer_class):
+    """Выводит из полей сериализатора, какие связи ему понадобятся."""
+    return _build_plan(serializer_class(), serializer_class.Meta.model)
+
+
+def _get_prefetch_lookups(plan):
+    return [
+        Prefetch(lookup, queryset=_apply_plan(
+            model._default_manager.all(), nested))
+        for lookup, model, nested in plan.prefetch
+    ]
+
+
+def _apply_plan(queryset, plan):
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+    return queryset.prefetch_related(*_get_prefetch_lookups(plan))
+
+
+def apply_prefetch_plan(queryset, serializer_class):
+    """Добавляет в queryset связи, которые читает сериализатор."""
+    return _apply_plan(queryset, get_prefetch_plan(serializer_class))
+
+
+def prefetch_for_serializer(instances, serializer_class):
+    """Догружает связи для уже полученных объектов."""
+    plan = get_prefetch_plan(serializer_class)
+    prefetch_related_objects(
+        instances, *plan.select_related, *_get_prefetch_lookups(plan))
@@ -0,0 +1,160 @@
+"""Быстрое чтение рецептов для list и retrieve.
+
+RecipeRowsSerializer отдаёт тот же JSON, что RecipeListSerializer, но
+собирает его из строк values() и словарей: без экземпляров моделей,
+объектов полей DRF и вложенных сериализаторов на каждую строку.
+Поля ответа берутся из Meta.fields сериализаторов, поэтому новое поле
+в них без пары здесь сразу даст KeyError, а не тихое расхождение.
+"""
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.http import Http404
+from rest_framework.response import Response
+
+from reviews.models import Ingredient, IngredientRecipes, Recipe, Tag
+from .serializers import (ImageVariantsField, RecipeListSerializer,
+                          TagSerializer, UserSerializer,
+                          get_ingredient_catalog, get_media_url,
+                          load_subscriptions)
+
+AUTHOR_FIELDS = tuple(
+    name for name in UserSerializer.Meta.fields if name != 'is_subscribed')
+TAG_FIELDS = TagSerializer.Meta.fields
+USER_FLAGS = ('is_in_shopping_cart', 'is_favorited')
+RECIPE_VALUES = (
+    'id', 'author_id', 'name', 'image', 'image_variants', 'text',
+    'cooking_time',
+    # Ключ сортировки нужен пагинации по курсору.
+    *(field.lstrip('-') for field in Recipe._meta.ordering
+      if field.lstrip('-') != 'id'),
+    *(f'author__{name}' for name in AUTHOR_FIELDS),
+)
+
+
+class RecipeRowsSerializer:
+    """Рецепты страницы в виде RecipeListSerializer из строк values()."""
+
+    def __init__(self, request):
+        self.request = request
+
+    def get_values(self, queryset):
+        """Строки рецептов вместе с данными автора, одним запросом."""
+        fields = RECIPE_VALUES
+        if self.request.user.is_authenticated:
+            fields += USER_FLAGS
+        return queryset.prefetch_related(None).values(*fields)
+
+    def get_authors(self, rows):
+        subscriptions = load_subscriptions(
+            self.request, {row['author_id'] for row in rows})
+        authors = {}
+        for row in rows:
+            author_id = row['author_id']
+            if author_id not in authors:
+                author = {
+                    name: row[f'author__{name}'] for name in AUTHOR_FIELDS}
+                author['is_subscribed'] = subscriptions[author_id]
+                authors[author_id] = author
+        return authors
+
+    @staticmethod
+    def get_tags(recipe_ids):
+        tags = {recipe_id: [] for recipe_id in recipe_ids}
+        rows = Tag.objects.filter(recipes__in=recipe_ids).values(
+            *TAG_FIELDS, recipe_id=F('recipes'))
+        for row in rows:
+            tags[row.pop('recipe_id')].append(row)
+        return tags
+
+    def get_ingredients(self, recipe_ids):
+        ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+        rows = list(IngredientRecipes.objects.filter(
+            recipe__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id', 'amount'))
+        catalog = get_ingredient_catalog(self.request)
+        missing = {row[1] for row in rows if row[1] not in catalog}
+        if missing:
+            # Ингредиент добавлен, а версия справочника ещё не сменилась.
+            catalog = {**catalog, **{
+                pk: (name, unit)
+                for pk, name, unit in Ingredient.objects.filter(
+                    pk__in=missing
+                ).values_list('pk', 'name', 'measurement_unit')
+            }}
+        for recipe_id, ingredient_id, amount in rows:
+            name, measurement_unit = catalog[ingredient_id]
+            ingredients[recipe_id].append({
+                'amount': amount,
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'id': ingredient_id,
+            })
+        return ingredients
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        request = self.request
+        recipe_ids = [row['id'] for row in rows]
+        authors = self.get_authors(rows)
+        tags = self.get_tags(recipe_ids)
+        ingredients = self.get_ingredients(recipe_ids)
+        getters = {
+            'id': itemgetter('id'),
+            'author': lambda row: authors[row['author_id']],
+            'name': itemgetter('name'),
+            'image': lambda row: get_media_url(request, row['image']),
+            'images': lambda row: ImageVariantsField.represent(
+                request, row['image'], row['image_variants']),
+            'text': itemgetter('text'),
+            'ingredients': lambda row: ingredients[row['id']],
+            'tags': lambda row: tags[row['id']],
+            'cooking_time': itemgetter('cooking_time'),
+        }
+        for flag in USER_FLAGS:
+            getters[flag] = (
+                itemgetter(flag) if request.user.is_authenticated
+                else lambda row: False)
+        fields = [
+            (name, getters[name]) for name in RecipeListSerializer.Meta.fields
+        ]
+        return [{name: get(row) for name, get in fields} for row in rows]
+
+
+class RecipeRowsMixin:
+    """list и retrieve через RecipeRowsSerializer.
+
+    Фильтры, пагинация и ответ те же, что у ModelViewSet; включается
+    настройкой RECIPES_FAST_READ.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not settings.RECIPES_FAST_READ:
+            return super().list(request, *args, **kwargs)
+        serializer = RecipeRowsSerializer(request)
+        rows = serializer.get_values(
+            self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(serializer.to_representation(rows))
+        return self.get_paginated_response(
+            serializer.to_representation(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.RECIPES_FAST_READ:
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        serializer = RecipeRowsSerializer(request)
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        data = serializer.to_representation(serializer.get_values(queryset))
+        if not data:
+            raise Http404
+        return Response(data[0])
@@ -0,0 +1,77 @@
+"""Форматы списка покупок.
+
+Рендереры выбираются обычным согласованием DRF (?format= или Accept)
+и умеют отдавать файл по частям через render_lines, чтобы ответ можно
+было стримить, не собирая весь список в памяти.
+"""
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+FIELDS = ('ingredient__name', 'amount_of_item',
+          'ingredient__measurement_unit')
+
+
+class ShoppingListRenderer(BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ошибки (401, 404) приходят словарём, а не списком строк.
+            return json.dumps(data, ensure_ascii=False).encode(self.charset)
+        return b''.join(self.render_lines(data))
+
+    def render_lines(self, ingredients):
+        """Байтовые куски файла для строк с полями FIELDS."""
+        raise NotImplementedError
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def render_lines(self, ingredients):
+        yield 'Список покупок:'.encode(self.charset)
+        for item in ingredients:
+            yield (
+                f"\n{item['ingredient__name']}: {item['amount_of_item']}, "
+                f"{item['ingredient__measurement_unit']}"
+            ).encode(self.charset)
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render_lines(self, ingredients):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+        for item in ingredients:
+            writer.writerow(item[field] for field in FIELDS)
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode(self.charset)
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render_lines(self, ingredients):
+        separator = '['
+        for item in ingredients:
+            yield (separator + json.dumps({
+                'name': item['ingredient__name'],
+                'amount': item['amount_of_item'],
+                'measurement_unit': item['ingredient__measurement_unit'],
+            }, ensure_ascii=False)).encode(self.charset)
+            separator = ','
+        yield ('[]' if separator == '[' else ']').encode(self.charset)
+
+
+SHOPPING_LIST_RENDERERS = (ShoppingListTextRenderer, ShoppingListCSVRenderer,
+                           ShoppingListJSONRenderer)
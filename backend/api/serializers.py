@@ -1,12 +1,68 @@
+import json
+
+from django.conf import settings
+from django.db import models, transaction
 from drf_base64.fields import Base64ImageField
-from rest_framework.validators import UniqueTogetherValidator
+from PIL import Image
 from rest_framework import serializers
+from rest_framework.utils import html
 
+from reviews.cart import change_recipe_ingredients
+from reviews.constants import IMAGE_SIZES
+from reviews.images import IMAGE_FORMATS, strip_metadata
 from reviews.models import (Favorite, Ingredient, Recipe, IngredientRecipes,
                             ShoppingList, Tag)
+from reviews.signals import muted_signals
 from users.models import Follow, User
 
-from .constans import MIN, MAX
+from .cache import bump_cart_versions
+from .constans import (MAX, MAX_AUTHORS_BATCH, MAX_BATCH, MIN,
+                       UPLOAD_IMAGE_FORMATS)
+from .ingredient_catalog import ingredient_catalog
+from .prefetch import prefetch_for_serializer
+
+
+def get_request_cache(request, name):
+    """Словарь, который живёт в пределах одного запроса."""
+    caches = request.__dict__.setdefault('_serializer_caches', {})
+    return caches.setdefault(name, {})
+
+
+def load_subscriptions(request, author_ids):
+    """Одним запросом узнаёт, на кого из авторов подписан пользователь."""
+    subscriptions = get_request_cache(request, 'subscriptions')
+    missing = set(author_ids) - subscriptions.keys()
+    if not missing:
+        return subscriptions
+    user = request.user
+    subscribed = set()
+    if user.is_authenticated:
+        subscribed = set(Follow.objects.filter(
+            user=user, author_id__in=missing
+        ).values_list('author_id', flat=True))
+    subscriptions.update(
+        {author_id: author_id in subscribed for author_id in missing})
+    return subscriptions
+
+
+def get_ingredient_catalog(request):
+    """Снимок справочника ингредиентов, один на запрос."""
+    cache = get_request_cache(request, 'ingredients')
+    if 'catalog' not in cache:
+        cache['catalog'] = ingredient_catalog.snapshot()
+    return cache['catalog']
+
+
+class SubscriptionsListSerializer(serializers.ListSerializer):
+    """Загружает подписки сразу для всех авторов страницы."""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        load_subscriptions(
+            self.context['request'],
+            [self.child.get_author_id(item) for item in iterable]
+        )
+        return super().to_representation(iterable)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -24,13 +80,23 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name',
             'is_subscribed'
         )
+        list_serializer_class = SubscriptionsListSerializer
+
+    @staticmethod
+    def get_author_id(instance):
+        return instance.pk
 
     def get_is_subscribed(self, instance):
         request = self.context['request']
-        user = request.user
+        return load_subscriptions(request, (instance.pk,))[instance.pk]
 
-        return user.is_authenticated and user.follower.filter(
-            author=instance).exists()
+    def to_representation(self, instance):
+        """Повторяющиеся в ответе пользователи сериализуются один раз."""
+        users = get_request_cache(self.context['request'], 'users')
+        key = (type(self), instance.pk)
+        if key not in users:
+            users[key] = super().to_representation(instance)
+        return users[key]
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -55,22 +121,77 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    name = serializers.ReadOnlyField(
-        source='ingredient.name'
-    )
+    """Название и единицы берутся из справочника, без JOIN."""
+
+    name = serializers.SerializerMethodField()
     id = serializers.PrimaryKeyRelatedField(
         source='ingredient',
         read_only=True
     )
-    measurement_unit = serializers.StringRelatedField(
-        source='ingredient.measurement_unit',
-        read_only=True
-    )
+    measurement_unit = serializers.SerializerMethodField()
 
     class Meta:
         model = IngredientRecipes
         fields = ('amount', 'name', 'measurement_unit', 'id')
 
+    def get_ingredient(self, instance):
+        catalog = get_ingredient_catalog(self.context['request'])
+        if instance.ingredient_id in catalog:
+            return catalog[instance.ingredient_id]
+        # Ингредиент добавлен, а версия справочника ещё не сменилась.
+        ingredient = instance.ingredient
+        return ingredient.name, ingredient.measurement_unit
+
+    def get_name(self, instance):
+        return self.get_ingredient(instance)[0]
+
+    def get_measurement_unit(self, instance):
+        return self.get_ingredient(instance)[1]
+
+
+def get_media_url(request, name):
+    """Ссылка на файл изображения рецепта, как её строит ImageField."""
+    if not name:
+        return None
+    url = Recipe.image.field.storage.url(name)
+    return request.build_absolute_uri(url) if request else url
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на миниатюры рецепта по размерам и форматам.
+
+    Пока миниатюры не собраны, вместо них отдаётся исходное изображение.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return self.represent(self.context.get('request'),
+                              recipe.image.name, recipe.image_variants)
+
+    @staticmethod
+    def represent(request, name, variants):
+        variants = variants or {}
+        if variants.get('source') != name:
+            variants = {}
+        original = get_media_url(request, name)
+        images = {}
+        for size in IMAGE_SIZES:
+            variant = variants.get(size, {})
+            images[size] = {
+                'width': variant.get('width'),
+                'height': variant.get('height'),
+                **{
+                    extension: get_media_url(request, variant.get(extension))
+                    for extension in IMAGE_FORMATS
+                },
+            }
+            if not variant:
+                images[size]['jpeg'] = original
+        return images
+
 
 class RecipeListSerializer(serializers.ModelSerializer):
     """Сериализатор модели рецептов."""
@@ -83,6 +204,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
     author = UserSerializer()
     tags = TagSerializer(many=True)
     image = Base64ImageField(required=True)
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -91,6 +213,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'author',
             'name',
             'image',
+            'images',
             'text',
             'ingredients',
             'tags',
@@ -98,20 +221,85 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'is_favorited'
         )
+        list_serializer_class = SubscriptionsListSerializer
+
+    @staticmethod
+    def get_author_id(instance):
+        return instance.author_id
+
+    def get_user_flag(self, instance, flag, related_name):
+        """Флаг из аннотации RecipeViewSet, иначе отдельный запрос."""
+        user = self.context['request'].user
+        if not user.is_authenticated:
+            return False
+        if hasattr(instance, flag):
+            return getattr(instance, flag)
+        return getattr(instance, related_name).filter(user=user).exists()
 
     def get_is_favorited(self, instance):
-        request = self.context.get('request')
-        return (request.user.is_authenticated and instance.favorites.filter(
-            user=request.user
-        ).exists())
+        return self.get_user_flag(instance, 'is_favorited', 'favorites')
 
     def get_is_in_shopping_cart(self, instance):
-        request = self.context.get('request')
-        return (
-            request.user.is_authenticated and instance.shopping_list.filter(
-                user=request.user
-            ).exists()
-        )
+        return self.get_user_flag(
+            instance, 'is_in_shopping_cart', 'shopping_list')
+
+
+class RecipeImageField(Base64ImageField):
+    """Изображение рецепта: строка base64 или файл из multipart.
+
+    Размер проверяется по длине строки или файла, формат и число
+    пикселей - по заголовку изображения, до чтения самих пикселей.
+    """
+
+    default_error_messages = {
+        'max_size': 'Размер изображения больше {max_size} МБ.',
+        'image_type': 'Допустимые форматы изображения: {formats}.',
+        'max_pixels': 'В изображении больше {max_pixels} пикселей.',
+    }
+
+    def fail_image_type(self):
+        self.fail('image_type', formats=', '.join(UPLOAD_IMAGE_FORMATS))
+
+    def check_size(self, size):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if size > max_size:
+            self.fail('max_size', max_size=max_size // (1024 * 1024))
+
+    def check_header(self, file):
+        max_pixels = settings.RECIPE_IMAGE_MAX_PIXELS
+        try:
+            with Image.open(file) as image:
+                if image.format not in UPLOAD_IMAGE_FORMATS:
+                    self.fail_image_type()
+                if image.width * image.height > max_pixels:
+                    self.fail('max_pixels', max_pixels=max_pixels)
+        except Image.DecompressionBombError:
+            self.fail('max_pixels', max_pixels=max_pixels)
+        except OSError:
+            self.fail('invalid_image')
+        finally:
+            file.seek(0)
+
+    def _decode(self, data):
+        if isinstance(data, str) and data.startswith('data:'):
+            header, _, encoded = data.partition(';base64,')
+            subtype = header.rpartition('/')[2].upper()
+            if {'JPG': 'JPEG'}.get(subtype, subtype) not in (
+                    UPLOAD_IMAGE_FORMATS):
+                self.fail_image_type()
+            self.check_size(len(encoded) * 3 // 4)
+        return super()._decode(data)
+
+    def to_internal_value(self, data):
+        file = self._decode(data)
+        if hasattr(file, 'size'):
+            self.check_size(file.size)
+            self.check_header(file)
+        file = super().to_internal_value(file)
+        if file:
+            # Иначе в исходнике останутся EXIF и координаты съёмки.
+            file = strip_metadata(file)
+        return file
 
 
 class IngredientCreateInRecipeSerializer(serializers.ModelSerializer):
@@ -129,12 +317,24 @@ class IngredientCreateInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
+class RecipeResponseMixin:
+    """Ответ на изменение рецепта - рецепт целиком, как при чтении."""
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        context = {'request': request}
+        prefetch_for_serializer([instance], RecipeListSerializer)
+        return RecipeListSerializer(instance,
+                                    context=context).data
+
+
+class RecipeCreateUpdateSerializer(RecipeResponseMixin,
+                                   serializers.ModelSerializer):
     """Сериализатор для создания и обновления рецептов."""
 
     ingredients = IngredientCreateInRecipeSerializer(many=True,
                                                      write_only=True)
-    image = Base64ImageField(allow_null=True, allow_empty_file=True)
+    image = RecipeImageField(allow_null=True, allow_empty_file=True)
     author = UserSerializer(read_only=True)
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
@@ -155,6 +355,29 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             'cooking_time'
         )
 
+    def to_internal_value(self, data):
+        """В multipart/form-data ингредиенты приходят строкой JSON,
+        а теги - повторяющимся полем или тоже строкой JSON."""
+        if html.is_html_input(data):
+            data = self.parse_form(data)
+        return super().to_internal_value(data)
+
+    @staticmethod
+    def parse_form(data):
+        form = {key: data.get(key) for key in data}
+        if 'tags' in data:
+            form['tags'] = data.getlist('tags')
+            if len(form['tags']) == 1 and form['tags'][0].startswith('['):
+                form['tags'] = form['tags'][0]
+        for key in ('ingredients', 'tags'):
+            if isinstance(form.get(key), str):
+                try:
+                    form[key] = json.loads(form[key])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {key: 'Ожидается список в формате JSON.'})
+        return form
+
     def validate(self, date):
         ingredients = date.get('ingredients')
         tags = date.get('tags')
@@ -172,6 +395,17 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'ingredients': 'Нельзя добавлять одинаковые ингредиенты'}
             )
+        catalog = get_ingredient_catalog(self.context['request'])
+        unknown = {pk for pk in ingredients_count if pk not in catalog}
+        if unknown:
+            # Справочник мог ещё не узнать о только что добавленных.
+            unknown -= set(Ingredient.objects.filter(
+                pk__in=unknown).values_list('pk', flat=True))
+        if unknown:
+            raise serializers.ValidationError(
+                {'ingredients': 'Ингредиенты не найдены: '
+                                f'{", ".join(map(str, sorted(unknown)))}.'}
+            )
         if len(tags) != len(set(tags)):
             raise serializers.ValidationError(
                 {'tags': 'Нельзя добавлять одинаковые теги.'}
@@ -201,24 +435,86 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
                                       recipe=recipe)
         return recipe
 
+    @staticmethod
+    def recipe_ingredient_sync(ingredients_data, recipe):
+        """Меняет только добавленные, изменённые и убранные ингредиенты.
+
+        Возвращает пары (ингредиент, количество), которые появились
+        в рецепте и исчезли из него, для итогов списков покупок.
+        """
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        existing = {
+            item.ingredient_id: item
+            for item in IngredientRecipes.objects.filter(recipe=recipe)
+        }
+        added, removed, changed, deleted = [], [], [], []
+        for ingredient_id, item in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount == item.amount:
+                continue
+            removed.append((ingredient_id, item.amount))
+            if amount is None:
+                deleted.append(item.pk)
+            else:
+                item.amount = amount
+                changed.append(item)
+                added.append((ingredient_id, amount))
+        created = [
+            IngredientRecipes(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        added += [(item.ingredient_id, item.amount) for item in created]
+        if deleted:
+            IngredientRecipes.objects.filter(pk__in=deleted).delete()
+        if changed:
+            IngredientRecipes.objects.bulk_update(changed, ('amount',))
+        if created:
+            IngredientRecipes.objects.bulk_create(created)
+        return added, removed
+
     def update(self, instance, validated_data):
+        """Одно сохранение рецепта и запись только изменившихся связей.
+
+        Сигналы на каждую связь заглушены: итоги списков покупок и их
+        версии обновляются здесь один раз на весь рецепт.
+        """
         ingredients_data = validated_data.pop('ingredients', None)
-        IngredientRecipes.objects.filter(recipe=instance).delete()
-        super().update(instance, validated_data)
-        self.recipe_ingredient_create(ingredients_data, instance)
-        return super().update(instance, validated_data)
+        tags = validated_data.pop('tags', None)
+        with transaction.atomic(), muted_signals():
+            super().update(instance, validated_data)
+            if tags is not None:
+                instance.tags.set(tags)
+            if ingredients_data is not None:
+                added, removed = self.recipe_ingredient_sync(
+                    ingredients_data, instance)
+                if added or removed:
+                    change_recipe_ingredients(instance.pk, added, removed)
+                    transaction.on_commit(
+                        lambda: bump_cart_versions((instance.pk,)))
+        return instance
+
+
+class RecipeImageSerializer(RecipeResponseMixin,
+                            serializers.ModelSerializer):
+    """Замена изображения рецепта файлом из тела запроса."""
+
+    image = RecipeImageField()
 
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        context = {'request': request}
-        return RecipeListSerializer(instance,
-                                    context=context).data
+    class Meta:
+        model = Recipe
+        fields = ('image',)
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     """Сериализатор для рецептов."""
 
     image = Base64ImageField(required=True)
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -226,7 +522,8 @@ class RecipeShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'cooking_time',
-            'image'
+            'image',
+            'images'
         )
 
 
@@ -241,17 +538,21 @@ class FollowSerializer(UserSerializer):
         read_only_fields = ('email', 'username', 'first_name', 'last_name')
 
     def get_recipes(self, instance):
-        request = self.context['request']
-        recipes_limit = request.GET.get('recipes_limit')
-        recipes = instance.recipes.all()
-        try:
+        recipes = getattr(instance, 'limited_recipes', None)
+        if recipes is None:
+            recipes = instance.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
             if recipes_limit:
-                recipes = recipes[:int(recipes_limit)]
-        except ValueError:
-            pass
+                recipes = recipes[:recipes_limit]
         return RecipeShortSerializer(recipes, many=True).data
 
 
+class RecipesLimitSerializer(serializers.Serializer):
+    """Проверка параметра recipes_limit."""
+
+    recipes_limit = serializers.IntegerField(min_value=MIN, required=False)
+
+
 class FollowCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания подписок."""
 
@@ -275,6 +576,7 @@ class FollowCreateSerializer(serializers.ModelSerializer):
         return data
 
     def to_representation(self, instance):
+        prefetch_for_serializer([instance.author], FollowSerializer)
         return FollowSerializer(
             instance=instance.author,
             context=self.context).data
@@ -283,20 +585,16 @@ class FollowCreateSerializer(serializers.ModelSerializer):
 class BaseCreateSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
+        prefetch_for_serializer([instance.recipe], RecipeShortSerializer)
         return RecipeShortSerializer(
             instance.recipe, context=self.context).data
 
-    def validate_unique_together(self, attrs, serializer):
-        queryset = self.Meta.model.objects.all()
-        fields = self.Meta.fields
-        message = self.Meta.message
-        validator = UniqueTogetherValidator(
-            queryset=queryset,
-            fields=fields,
-            message=message
-        )
-        validator.set_context(serializer)
-        validator(attrs)
+    def validate(self, data):
+        if self.Meta.model.objects.filter(
+                user=data['user'], recipe=data['recipe']
+        ).exists():
+            raise serializers.ValidationError(self.Meta.message)
+        return data
 
 
 class FavoriteCreateSerializer(BaseCreateSerializer):
@@ -315,3 +613,28 @@ class ShoppingListCreateSerializer(BaseCreateSerializer):
         model = ShoppingList
         fields = ('user', 'recipe')
         message = 'Рецепт в списке покупок.'
+
+
+class IdListField(serializers.ListField):
+    """Непустой список id без повторов, в исходном порядке."""
+
+    child = serializers.IntegerField(min_value=MIN)
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_empty', False)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        return list(dict.fromkeys(super().to_internal_value(data)))
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления и удаления."""
+
+    recipes = IdListField(max_length=MAX_BATCH)
+
+
+class AuthorIdsSerializer(serializers.Serializer):
+    """Список id авторов для пакетной подписки и отписки."""
+
+    authors = IdListField(max_length=MAX_AUTHORS_BATCH)
@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from reviews.models import (Favorite, Ingredient, IngredientRecipes, Recipe,
+                            ShoppingList, Tag)
+from reviews.signals import skip_when_muted
+from users.models import Follow, User
+from .cache import bump_cart_versions, bump_version
+from .ingredient_index import build_index
+
+
+class BatchedCallback:
+    """Вызов func со всеми значениями, накопленными за транзакцию."""
+
+    def __init__(self, func):
+        self.func = func
+        self.values = set()
+
+    def __call__(self):
+        self.func(self.values)
+
+
+def on_commit_batched(func, value):
+    """Один вызов func(values) после фиксации вместо вызова на запись.
+
+    Пакет живёт в очереди on_commit соединения, поэтому при откате
+    транзакции он пропадает вместе с ней.
+    """
+    for _, callback in transaction.get_connection().run_on_commit:
+        if isinstance(callback, BatchedCallback) and callback.func is func:
+            callback.values.add(value)
+            return
+    callback = BatchedCallback(func)
+    callback.values.add(value)
+    transaction.on_commit(callback)
+
+
+def rebuild_ingredient_index(ingredient_ids):
+    build_index()
+    bump_version('ingredients')
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def schedule_ingredient_index_rebuild(instance, **kwargs):
+    """Перестраивает индекс один раз после фиксации транзакции."""
+    on_commit_batched(rebuild_ingredient_index, instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(**kwargs):
+    transaction.on_commit(lambda: bump_version('tags'))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+@skip_when_muted
+def bump_user_version(instance, **kwargs):
+    """Флаги избранного, покупок и подписок пользователя изменились."""
+    transaction.on_commit(
+        lambda: bump_version(f'user:{instance.user_id}'))
+
+
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+@skip_when_muted
+def bump_cart_version(instance, **kwargs):
+    transaction.on_commit(
+        lambda: bump_version(f'cart:{instance.user_id}'))
+
+
+@receiver(post_save, sender=IngredientRecipes)
+@receiver(post_delete, sender=IngredientRecipes)
+@skip_when_muted
+def schedule_cart_versions_bump(instance, **kwargs):
+    """Списки покупок с рецептом меняются одним запросом на транзакцию."""
+    on_commit_batched(bump_cart_versions, instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipes_version(**kwargs):
+    """Рецепт появился, удалён или изменён: списки рецептов изменились.
+
+    От названия и описания зависит число рецептов в поиске, поэтому
+    версия меняется и при правке рецепта.
+    """
+    transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipes_version_on_tags_change(action, **kwargs):
+    """От тегов рецептов зависит число рецептов при фильтре по тегам."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: bump_version('recipes'))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_users_version(created=True, **kwargs):
+    if created:
+        transaction.on_commit(lambda: bump_version('users'))
@@ -1,5 +1,8 @@
-from django.db.models import Sum, Count
-from django.http import FileResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
@@ -8,17 +11,42 @@ from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         SAFE_METHODS)
 from rest_framework.response import Response
 
-from reviews.models import (Favorite, Ingredient, Recipe, IngredientRecipes,
-                            ShoppingList, Tag)
+from reviews.models import (Favorite, Ingredient, Recipe,
+                            ShoppingCartIngredient, ShoppingList, Tag)
+from reviews.signals import (follows_changed, muted_signals,
+                             recipe_links_changed)
 from users.models import Follow, User
-from .serializers import (UserSerializer, FollowCreateSerializer,
+from .serializers import (UserSerializer, AuthorIdsSerializer,
+                          FollowCreateSerializer,
                           FollowSerializer, IngredientSerializer,
-                          RecipeCreateUpdateSerializer, RecipeListSerializer,
+                          RecipeCreateUpdateSerializer, RecipeImageSerializer,
+                          RecipeListSerializer,
                           TagSerializer, FavoriteCreateSerializer,
+                          RecipeIdsSerializer, RecipesLimitSerializer,
                           ShoppingListCreateSerializer)
+from .cache import (ConditionalRecipeMixin, VersionedCacheMixin,
+                    bump_version, get_not_modified_response, get_version,
+                    make_etag, set_conditional_headers, stream_to_cache)
 from .filters import RecipeFilter, IngredientFilter
+from .ingredient_index import ingredient_index
 from .pagination import Paginator
+from .parsers import ImageUploadParser
+from .prefetch import (apply_prefetch_plan, prefetch_for_serializer,
+                       prefetch_limited_recipes)
 from .permissions import IsAuthorOrReadOnly
+from .recipe_rows import RecipeRowsMixin
+from .renderers import SHOPPING_LIST_RENDERERS
+
+
+def lock_user(user):
+    """Блокирует строку пользователя до конца транзакции.
+
+    Пакетные изменения сначала читают существующие связи, а потом
+    сдвигают счётчики на разницу. Без блокировки два одинаковых
+    запроса увидят одни и те же недостающие связи и сдвинут счётчики
+    дважды, хотя вставятся строки только одного из них.
+    """
+    User.objects.select_for_update().only('pk').get(pk=user.pk)
 
 
 class UserCustomViewSet(UserViewSet):
@@ -26,13 +54,22 @@ class UserCustomViewSet(UserViewSet):
 
     queryset = User.objects.all()
     pagination_class = Paginator
+    keyset_ordering = ('username', 'id')
+    count_version = 'users'
     serializer_class = UserSerializer
 
     def get_permissions(self):
-        if self.action in ('me', 'subscriptions', 'subscribe'):
+        if self.action in ('me', 'subscriptions', 'subscribe',
+                           'delete_subscribe', 'subscribe_batch',
+                           'delete_subscribe_batch'):
             return (IsAuthenticated(),)
         return (AllowAny(),)
 
+    def get_recipes_limit(self):
+        serializer = RecipesLimitSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data.get('recipes_limit')
+
     @action(
         detail=False,
         methods=('get',),
@@ -40,14 +77,18 @@ class UserCustomViewSet(UserViewSet):
         url_path='subscriptions',
     )
     def subscriptions(self, request):
+        recipes_limit = self.get_recipes_limit()
         following_users = User.objects.filter(
             following__user=self.request.user
-        ).annotate(
-            recipes_count=Count('recipes'))
+        ).order_by(*self.keyset_ordering)
         paginated_queryset = self.paginate_queryset(following_users)
+        authors = (list(following_users) if paginated_queryset is None
+                   else paginated_queryset)
+        prefetch_for_serializer(authors, FollowSerializer)
+        prefetch_limited_recipes(authors, recipes_limit)
         serializer = FollowSerializer(
-            paginated_queryset,
-            context={'request': request},
+            authors,
+            context={'request': request, 'recipes_limit': recipes_limit},
             many=True
         )
         if paginated_queryset is not None:
@@ -67,7 +108,10 @@ class UserCustomViewSet(UserViewSet):
                 'user': request.user.id,
                 'author': id
             },
-            context={'request': request}
+            context={
+                'request': request,
+                'recipes_limit': self.get_recipes_limit()
+            }
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
@@ -84,19 +128,82 @@ class UserCustomViewSet(UserViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    def change_subscriptions_batch(self, request, add):
+        """Пакетная подписка или отписка одной транзакцией.
+
+        Авторы проверяются одним запросом, подписки создаются через
+        bulk_create; себя и уже отслеживаемых авторов пропускаем, не
+        полагаясь на ошибки ограничений базы.
+        """
+        serializer = AuthorIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        author_ids = serializer.validated_data['authors']
+        user = request.user
+        with transaction.atomic(), muted_signals():
+            lock_user(user)
+            if add:
+                authors = dict(User.objects.filter(
+                    pk__in=author_ids
+                ).annotate(is_subscribed=Exists(Follow.objects.filter(
+                    user=user, author=OuterRef('pk')))
+                ).values_list('pk', 'is_subscribed'))
+                changed = {
+                    author_id for author_id, is_subscribed in authors.items()
+                    if not is_subscribed and author_id != user.pk
+                }
+                Follow.objects.bulk_create(
+                    (Follow(user=user, author_id=author_id)
+                     for author_id in changed),
+                    ignore_conflicts=True)
+                statuses = {author_id: 'exists' for author_id in authors}
+                statuses[user.pk] = 'self'
+                statuses.update(dict.fromkeys(changed, 'subscribed'))
+            else:
+                changed = set(Follow.objects.filter(
+                    user=user, author_id__in=author_ids
+                ).values_list('author_id', flat=True))
+                Follow.objects.filter(
+                    user=user, author_id__in=changed).delete()
+                statuses = dict.fromkeys(changed, 'unsubscribed')
+            if changed:
+                follows_changed(user.pk, changed, add)
+                transaction.on_commit(
+                    lambda: bump_version(f'user:{user.pk}'))
+        return Response({'authors': [
+            {'id': author_id, 'status': statuses.get(author_id, 'not_found')}
+            for author_id in author_ids
+        ]})
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(
+        detail=False,
+        methods=('post',),
+        permission_classes=(IsAuthenticated,),
+        url_path='subscribe',
+        url_name='subscribe-batch'
+    )
+    def subscribe_batch(self, request):
+        return self.change_subscriptions_batch(request, add=True)
+
+    @subscribe_batch.mapping.delete
+    def delete_subscribe_batch(self, request):
+        return self.change_subscriptions_batch(request, add=False)
+
+
+class TagViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для тегов."""
 
+    cache_version = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """Вьюсет для ингредиентов."""
 
+    cache_version = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
@@ -104,17 +211,41 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(name))
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalRecipeMixin, RecipeRowsMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет для рецептов."""
 
-    queryset = Recipe.objects.select_related('author').prefetch_related(
-        'tags', 'ingredients')
+    queryset = Recipe.objects.all()
     permission_classes = (IsAuthorOrReadOnly,)
     pagination_class = Paginator
+    keyset_ordering = Recipe._meta.ordering
+    count_version = 'recipes'
+    user_count_params = ('is_favorited', 'is_in_shopping_cart')
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        queryset = apply_prefetch_plan(queryset, RecipeListSerializer)
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingList.objects.filter(
+                user=user, recipe=OuterRef('pk')))
+        )
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeListSerializer
@@ -141,6 +272,52 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def change_recipes_batch(request, model, add):
+        """Пакетное добавление или удаление рецептов одной транзакцией.
+
+        Число запросов не зависит от размера пачки: сигналы на каждую
+        запись заглушены, счётчики и версии обновляются для всей пачки.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        user = request.user
+        with transaction.atomic(), muted_signals():
+            lock_user(user)
+            linked = set(model.objects.filter(
+                user=user, recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True))
+            if add:
+                found = set(Recipe.objects.filter(
+                    pk__in=recipe_ids).values_list('pk', flat=True))
+                changed = found - linked
+                model.objects.bulk_create(
+                    (model(user=user, recipe_id=recipe_id)
+                     for recipe_id in changed),
+                    ignore_conflicts=True)
+                statuses = {recipe_id: 'not_found' for recipe_id in recipe_ids}
+                statuses.update(dict.fromkeys(linked, 'exists'))
+                statuses.update(dict.fromkeys(changed, 'added'))
+            else:
+                changed = linked
+                model.objects.filter(
+                    user=user, recipe_id__in=changed).delete()
+                statuses = {
+                    recipe_id: 'removed' if recipe_id in changed
+                    else 'not_found' for recipe_id in recipe_ids
+                }
+            if changed:
+                recipe_links_changed(model, user.pk, changed, add)
+                versions = [f'user:{user.pk}']
+                if model is ShoppingList:
+                    versions.append(f'cart:{user.pk}')
+                transaction.on_commit(lambda: bump_version(*versions))
+        return Response({'recipes': [
+            {'id': recipe_id, 'status': statuses[recipe_id]}
+            for recipe_id in recipe_ids
+        ]})
+
     @action(
         detail=True,
         methods=['post'],
@@ -163,30 +340,83 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def delete_shopping_cart(self, request, **kwargs):
         return self.delete_recipes(request, ShoppingList, **kwargs)
 
-    @staticmethod
-    def creating_shopping_list(ingredients):
-        purchased = ['Список покупок:', ]
-        for item in ingredients:
-            purchased.append(
-                f"{item['ingredient__name']}: {item['amount_of_item']}, "
-                f"{item['ingredient__measurement_unit']}"
-            )
-        purchased_file = "\n".join(purchased)
-        return purchased_file
+    @action(
+        detail=False,
+        methods=('post',),
+        permission_classes=(IsAuthenticated,),
+        url_path='favorite',
+        url_name='favorite-batch')
+    def favorite_batch(self, request):
+        return self.change_recipes_batch(request, Favorite, add=True)
+
+    @favorite_batch.mapping.delete
+    def delete_favorite_batch(self, request):
+        return self.change_recipes_batch(request, Favorite, add=False)
+
+    @action(
+        detail=False,
+        methods=('post',),
+        permission_classes=(IsAuthenticated,),
+        url_path='shopping_cart',
+        url_name='shopping_cart-batch')
+    def shopping_cart_batch(self, request):
+        return self.change_recipes_batch(request, ShoppingList, add=True)
+
+    @shopping_cart_batch.mapping.delete
+    def delete_shopping_cart_batch(self, request):
+        return self.change_recipes_batch(request, ShoppingList, add=False)
+
+    @action(
+        detail=True,
+        methods=('put',),
+        parser_classes=(ImageUploadParser,))
+    def image(self, request, pk):
+        """Изображение рецепта телом запроса, без base64 и multipart."""
+        recipe = self.get_object()
+        serializer = RecipeImageSerializer(
+            recipe, data={'image': request.data.get('file')},
+            context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
 
     @action(
         detail=False,
         methods=('get',),
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS
     )
     def download_shopping_cart(self, request):
-        ingredients = IngredientRecipes.objects.filter(
-            recipe__shopping_list__user=self.request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
-            amount_of_item=Sum('amount')).order_by('ingredient__name')
-        purchased_list = self.creating_shopping_list(ingredients)
-        response = FileResponse(purchased_list, content_type="text/plain")
-        response['Content-Disposition'] = (
-            'attachment; filename=shopping-list.txt'
-        )
+        """Список покупок в формате txt, csv или json (?format=).
+
+        Готовый файл кэшируется по версии списка покупок пользователя,
+        повторная загрузка с тем же ETag получает 304.
+        """
+        user = self.request.user
+        renderer = request.accepted_renderer
+        etag = make_etag(user.pk, renderer.format,
+                         get_version(f'cart:{user.pk}'),
+                         get_version('ingredients'))
+        response = get_not_modified_response(request, etag)
+        if response is None:
+            content_type = f'{renderer.media_type}; charset={renderer.charset}'
+            key = f'shopping_list:{etag}'
+            content = cache.get(key)
+            if content is not None:
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                ingredients = ShoppingCartIngredient.objects.filter(
+                    user=user).values(
+                    'ingredient__name', 'ingredient__measurement_unit',
+                    amount_of_item=F('total_amount')
+                ).order_by('ingredient__name')
+                response = StreamingHttpResponse(
+                    stream_to_cache(
+                        renderer.render_lines(ingredients.iterator()), key),
+                    content_type=content_type)
+            response['Content-Disposition'] = (
+                f'attachment; filename=shopping-list.{renderer.format}'
+            )
+            set_conditional_headers(response, etag)
+        patch_vary_headers(response, ('Authorization',))
         return response
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -87,6 +88,36 @@ if os.getenv('DB_ENV', 'sqlite') == 'postgres':
 else:
     DATABASES = SQLITE
 
+# В docker-compose кэш - memcached, общий для всех контейнеров backend.
+# Без CACHE_BACKEND - файловый, общий только для процессов одного хоста.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache')
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', str(BASE_DIR / '.cache'))
+
+# Версии данных (api.cache.get_version) в отдельном кэше: вытеснение
+# ответов и count не должно задевать ключи, по которым их сбрасывают.
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+        'KEY_PREFIX': 'data',
+    },
+    'versions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+        'KEY_PREFIX': 'versions',
+    },
+}
+
+if CACHE_BACKEND.endswith('FileBasedCache'):
+    # По умолчанию файловый кэш после 300 записей удаляет треть случайных.
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100_000)),
+    }
+    # Версий не больше двух на пользователя, их не вытесняем вовсе.
+    CACHES['versions']['LOCATION'] = os.path.join(CACHE_LOCATION, 'versions')
+    CACHES['versions']['OPTIONS'] = {'MAX_ENTRIES': sys.maxsize}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -115,6 +146,20 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6
 }
 
+# Сколько секунд хранить count постраничных ответов
+PAGINATION_COUNT_TTL = int(os.getenv('PAGINATION_COUNT_TTL', 60))
+# С какого числа строк PostgreSQL отдаёт оценку планировщика, 0 - никогда
+PAGINATION_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_ESTIMATE_THRESHOLD', 0))
+
+# Предельный размер изображения рецепта в байтах и в пикселях
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024))
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.getenv('RECIPE_IMAGE_MAX_PIXELS', 40_000_000))
+# Рецепты на чтение собираются из values() без RecipeListSerializer
+RECIPES_FAST_READ = os.getenv('RECIPES_FAST_READ', 'False') == 'True'
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'PERMISSIONS': {
@@ -148,6 +193,11 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Префиксный индекс ингредиентов, общий для всех процессов
+INGREDIENT_INDEX_PATH = os.getenv(
+    'INGREDIENT_INDEX_PATH', BASE_DIR / 'ingredients.idx')
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 100))
+
 AUTH_USER_MODEL = 'users.User'
 
 DJOSER = {
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Prefetch
 from django.utils.safestring import mark_safe
 
 from .models import (Favorite, Ingredient, Recipe, IngredientRecipes,
@@ -9,6 +10,7 @@ class RecipeIngredientInline(admin.TabularInline):
     model = IngredientRecipes
     extra = 1
     min_num = 1
+    autocomplete_fields = ('ingredient',)
 
 
 @admin.register(Recipe)
@@ -16,13 +18,17 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIngredientInline,)
     list_display = ('name', 'author',
                     'favorites_count', 'get_ingredients_display')
-    search_fields = ('name',)
-    list_filter = ('name', 'author', 'tags')
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username')
+    list_filter = ('tags',)
+    autocomplete_fields = ('author',)
+    show_full_result_count = False
     exclude = ('ingredients',)
 
-    @admin.display(description='Добавлено в избранное')
-    def favorites_count(self, obj):
-        return mark_safe(f'<img src="{obj.image.url}" width="80" height="60">')
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('ingredients',
+                     queryset=Ingredient.objects.only('id', 'name')))
 
     @admin.display(description='Изображение')
     def get_img(self, obj):
@@ -45,10 +51,16 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Ingredient)
 class IngredientsAdmin(admin.ModelAdmin):
-    list_display = ('name',)
-    list_filter = ('name',)
+    list_display = ('name', 'measurement_unit')
+    list_filter = ('measurement_unit',)
     search_fields = ('name',)
+    show_full_result_count = False
 
 
-admin.site.register(ShoppingList)
-admin.site.register(Favorite)
+@admin.register(Favorite, ShoppingList)
+class RecipeUserAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe__author')
+    search_fields = ('user__username', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
@@ -0,0 +1,113 @@
+"""Итоги списков покупок по ингредиентам (ShoppingCartIngredient).
+
+Изменения применяются дельтами: ингредиент -> (количество, рецепты).
+"""
+from collections import defaultdict
+
+from django.apps import apps as global_apps
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import IngredientRecipes, ShoppingList
+
+
+def recipe_deltas(added=(), removed=()):
+    """Дельты для добавленных и убранных пар (ингредиент, количество)."""
+    deltas = defaultdict(lambda: (0, 0))
+    for sign, items in ((1, added), (-1, removed)):
+        for ingredient_id, amount in items:
+            total, recipes = deltas[ingredient_id]
+            deltas[ingredient_id] = (total + sign * amount, recipes + sign)
+    return deltas
+
+
+def apply_cart_deltas(user_ids, deltas, apps=global_apps):
+    """Три запроса на любое число пользователей и ингредиентов."""
+    user_ids = list(user_ids)
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not user_ids or not deltas:
+        return
+    model = apps.get_model('reviews', 'ShoppingCartIngredient')
+    # Строки нужны только там, где ингредиент появляется в рецептах.
+    model.objects.bulk_create((
+        model(user_id=user_id, ingredient_id=ingredient_id)
+        for user_id in user_ids
+        for ingredient_id, (_, recipes) in deltas.items() if recipes > 0
+    ), ignore_conflicts=True)
+    rows = model.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas)
+    rows.update(**{
+        field: Greatest(F(field) + Case(
+            *(When(ingredient_id=ingredient_id, then=Value(delta[index]))
+              for ingredient_id, delta in deltas.items()),
+            default=Value(0)), 0)
+        for index, field in enumerate(('total_amount', 'recipe_count'))
+    })
+    rows.filter(recipe_count__lte=0).delete()
+
+
+def change_cart_recipes(user_id, recipe_ids, added):
+    """Рецепты добавлены в список покупок пользователя или убраны из него."""
+    items = list(IngredientRecipes.objects.filter(
+        recipe_id__in=recipe_ids).values_list('ingredient_id', 'amount'))
+    deltas = (recipe_deltas(added=items) if added
+              else recipe_deltas(removed=items))
+    apply_cart_deltas((user_id,), deltas)
+
+
+def change_recipe_ingredients(recipe_id, added=(), removed=()):
+    """Состав рецепта изменился: пары (ингредиент, количество).
+
+    Меняет итоги всех, у кого рецепт в списке покупок.
+    """
+    deltas = recipe_deltas(added, removed)
+    if not any(any(delta) for delta in deltas.values()):
+        return
+    user_ids = ShoppingList.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True)
+    apply_cart_deltas(user_ids, deltas)
+
+
+def live_cart_totals(apps=global_apps, **filters):
+    """Итоги, посчитанные напрямую по спискам покупок и рецептам."""
+    model = apps.get_model('reviews', 'IngredientRecipes')
+    return {
+        (row['recipe__shopping_list__user'], row['ingredient']):
+            (row['total_amount'], row['recipe_count'])
+        for row in model.objects.filter(
+            recipe__shopping_list__isnull=False, **filters
+        ).values('recipe__shopping_list__user', 'ingredient').annotate(
+            total_amount=Sum('amount'), recipe_count=Count('recipe')
+        ).order_by().iterator()
+    }
+
+
+def rebuild_cart_totals(fix=True, apps=global_apps):
+    """Сверяет итоги с живым GROUP BY, при fix пересобирает разошедшиеся.
+
+    Возвращает id пользователей с расхождениями.
+    """
+    model = apps.get_model('reviews', 'ShoppingCartIngredient')
+    live = live_cart_totals(apps)
+    stored = {
+        (user_id, ingredient_id): (total_amount, recipe_count)
+        for user_id, ingredient_id, total_amount, recipe_count
+        in model.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount', 'recipe_count'
+        ).iterator()
+    }
+    user_ids = {
+        user_id for user_id, _ in live.keys() ^ stored.keys()
+    } | {
+        key[0] for key in live.keys() & stored.keys()
+        if live[key] != stored[key]
+    }
+    if fix and user_ids:
+        model.objects.filter(user_id__in=user_ids).delete()
+        model.objects.bulk_create(
+            model(user_id=user_id, ingredient_id=ingredient_id,
+                  total_amount=total_amount, recipe_count=recipe_count)
+            for (user_id, ingredient_id), (total_amount, recipe_count)
+            in live.items() if user_id in user_ids
+        )
+    return user_ids
@@ -2,3 +2,14 @@ MEDIUM_LENGTH = 200
 MAX_COLOR = 7
 MIN = 1
 MAX = 32000
+# PNG 1x1 для рецептов, созданных командами генерации данных.
+PLACEHOLDER_IMAGE = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360f8cfc0f01f0005000201a55d2a'
+    '460000000049454e44ae426082'
+)
+# Размеры миниатюр рецептов: имя -> вписать в (ширина, высота).
+IMAGE_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+}
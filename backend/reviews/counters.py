@@ -0,0 +1,46 @@
+from django.apps import apps as global_apps
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+# Счётчик, модель связей и поле связей, указывающее на владельца счётчика.
+COUNTERS = (
+    ('reviews.Recipe', 'favorites_count', 'reviews.Favorite', 'recipe'),
+    ('reviews.Recipe', 'in_carts_count', 'reviews.ShoppingList', 'recipe'),
+    ('users.User', 'recipes_count', 'reviews.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+    ('users.User', 'following_count', 'users.Follow', 'user'),
+    ('reviews.StoredImage', 'references', 'reviews.Recipe', 'image'),
+)
+
+
+def change_counters(model, pks, field, delta):
+    """Сдвигает счётчик у записей pks одним запросом, не читая значений."""
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def actual_count(related_model, related_field):
+    """Подзапрос с настоящим числом связанных записей."""
+    counts = related_model.objects.filter(
+        **{related_field: OuterRef('pk')}
+    ).order_by().values(related_field).annotate(
+        count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts), 0)
+
+
+def reconcile_counters(fix=True, apps=global_apps):
+    """Находит разошедшиеся счётчики и, если fix, пересчитывает их.
+
+    Возвращает число расхождений для каждого счётчика.
+    """
+    drift = {}
+    for label, field, related_label, related_field in COUNTERS:
+        model = apps.get_model(label)
+        count = actual_count(apps.get_model(related_label), related_field)
+        drifted = model.objects.annotate(actual=count).exclude(
+            **{field: F('actual')}).values('pk')
+        drift[f'{label}.{field}'] = drifted.count()
+        if fix and drift[f'{label}.{field}']:
+            model.objects.filter(pk__in=Subquery(drifted)).update(
+                **{field: count})
+    return drift
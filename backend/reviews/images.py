@@ -0,0 +1,258 @@
+import logging
+import posixpath
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.apps import apps as global_apps
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .constants import IMAGE_SIZES
+from .counters import change_counters
+from .models import Recipe, StoredImage
+
+logger = logging.getLogger(__name__)
+
+# Расширение -> формат Pillow и параметры сохранения.
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True,
+                      'progressive': True}),
+}
+
+
+def get_storage():
+    return Recipe.image.field.storage
+
+
+def variant_path(name, size, extension):
+    """Миниатюра называется по исходному файлу, а тот - по содержимому."""
+    return f'recipes/{size}/{PurePosixPath(name).stem}.{extension}'
+
+
+def variant_paths(name):
+    return [
+        variant_path(name, size, extension)
+        for size in IMAGE_SIZES for extension in IMAGE_FORMATS
+    ]
+
+
+# Ключи Image.info с метаданными, которые не должны попасть в файлы.
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment')
+ORIENTATION = 0x0112
+
+
+def has_metadata(image):
+    return bool(image.getexif()) or any(
+        key in image.info for key in METADATA_KEYS)
+
+
+def strip_metadata(file):
+    """Загруженное изображение без EXIF (с GPS), XMP и комментариев.
+
+    Поворот из EXIF переносится в пиксели, цветовой профиль остаётся.
+    Файл без метаданных и GIF возвращаются как есть; JPEG без поворота
+    пересжимается с таблицами квантования исходника.
+    """
+    with Image.open(file) as image:
+        image_format = image.format
+        if image_format == 'GIF' or not has_metadata(image):
+            file.seek(0)
+            return file
+        params = {}
+        if image.info.get('icc_profile'):
+            params['icc_profile'] = image.info['icc_profile']
+        if image.getexif().get(ORIENTATION, 1) != 1:
+            image = ImageOps.exif_transpose(image)
+            if image_format == 'JPEG':
+                params.update(quality=95)
+        elif image_format == 'JPEG':
+            params.update(quality='keep', subsampling='keep')
+        if image_format == 'WEBP':
+            params.update(quality=90)
+        for key in METADATA_KEYS:
+            image.info.pop(key, None)
+        buffer = BytesIO()
+        image.save(buffer, image_format, **params)
+    return ContentFile(buffer.getvalue(), name=file.name)
+
+
+def open_rgb(name, storage, box):
+    """Исходное изображение в RGB, вписанное в box, с поворотом из EXIF.
+
+    JPEG декодируется сразу в уменьшенном масштабе (draft), остальные
+    форматы уменьшаются до перевода в RGB.
+    """
+    with storage.open(name) as file, Image.open(file) as image:
+        image.draft('RGB', box)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(box, Image.LANCZOS)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+
+
+def save_variant(image, path, extension, storage):
+    image_format, params = IMAGE_FORMATS[extension]
+    buffer = BytesIO()
+    image.save(buffer, image_format, **params)
+    storage.delete(path)
+    return storage.save_as(path, ContentFile(buffer.getvalue()))
+
+
+def make_image_variants(name):
+    """Пишет миниатюры всех размеров в WebP и JPEG без метаданных.
+
+    Возвращает описание для Recipe.image_variants: исходный файл и для
+    каждого размера - габариты и пути к файлам. Одна копия изображения
+    уменьшается thumbnail() от большего размера к меньшему. WebP
+    пропускается, если Pillow собран без него.
+    """
+    storage = get_storage()
+    sizes = sorted(IMAGE_SIZES.items(),
+                   key=lambda item: item[1][0] * item[1][1], reverse=True)
+    image = open_rgb(name, storage, sizes[0][1])
+    image.info = {}
+    built = {}
+    for size, box in sizes:
+        image.thumbnail(box, Image.LANCZOS)
+        variant = {'width': image.width, 'height': image.height}
+        for extension in IMAGE_FORMATS:
+            variant[extension] = None
+            if extension != 'webp' or features.check('webp'):
+                variant[extension] = save_variant(
+                    image, variant_path(name, size, extension), extension,
+                    storage)
+        built[size] = variant
+    return {'source': name, **{size: built[size] for size in IMAGE_SIZES}}
+
+
+def update_image_variants(recipe, force=False):
+    """Пересобирает миниатюры рецепта, если сменилось изображение.
+
+    Миниатюры того же файла у другого рецепта берутся готовыми.
+    Битое изображение не мешает сохранению рецепта: клиенты получат
+    исходный файл, а миниатюры соберёт следующее сохранение или
+    команда build_image_variants.
+    """
+    name = recipe.image.name
+    if not name or (
+        (recipe.image_variants or {}).get('source') == name and not force
+    ):
+        return False
+    variants = None
+    if not force:
+        variants = Recipe.objects.filter(
+            image=name, image_variants__source=name
+        ).values_list('image_variants', flat=True).first()
+    if variants is None:
+        try:
+            variants = make_image_variants(name)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.warning('Не удалось собрать миниатюры %s', name,
+                           exc_info=True)
+            return False
+    updated = Recipe.objects.filter(pk=recipe.pk, image=name).update(
+        image_variants=variants, updated_at=timezone.now())
+    if not updated:
+        # Пока миниатюры собирались, изображение успели заменить.
+        release_image(name)
+        return False
+    recipe.image_variants = variants
+    return True
+
+
+def lock_image(name):
+    """Блокирует файл name до конца транзакции, заводя его запись.
+
+    Пока блокировка держится, release_image не удалит файл, поэтому
+    проверке его существования при записи можно верить.
+    """
+    StoredImage.objects.bulk_create(
+        (StoredImage(name=name),), ignore_conflicts=True)
+    if transaction.get_connection().in_atomic_block:
+        StoredImage.objects.select_for_update().filter(name=name).first()
+
+
+def change_image_references(name, delta):
+    """Сдвигает число рецептов с файлом в транзакции записи рецепта."""
+    if not name:
+        return
+    if delta > 0:
+        StoredImage.objects.bulk_create(
+            (StoredImage(name=name),), ignore_conflicts=True)
+    change_counters(StoredImage, (name,), 'references', delta)
+
+
+def register_images(fix=True, apps=global_apps):
+    """Заводит записи для файлов рецептов, созданных без сигналов.
+
+    Число ссылок им проставит reconcile_counters. Возвращает, сколько
+    записей не хватало.
+    """
+    model = apps.get_model('reviews', 'StoredImage')
+    names = set(apps.get_model('reviews', 'Recipe').objects.exclude(
+        image=''
+    ).exclude(
+        image__in=model.objects.values('name')
+    ).values_list('image', flat=True).distinct())
+    if fix:
+        model.objects.bulk_create(
+            (model(name=name) for name in names), ignore_conflicts=True)
+    return len(names)
+
+
+def sweep_images(fix=True):
+    """Удаляет файлы изображений без записи StoredImage и без рецептов.
+
+    Файл пишется при сохранении поля, до фиксации рецепта; если его
+    транзакция откатилась, запись из lock_image откатывается вместе с
+    ней, а файл остаётся. Перед удалением файл блокируется lock_image:
+    незафиксированная загрузка того же файла дождётся своей фиксации, и
+    release_image увидит её ссылку. Возвращает число таких файлов.
+    """
+    storage = get_storage()
+    directory = Recipe.image.field.upload_to
+    if not storage.exists(directory):
+        return 0
+    names = {
+        posixpath.join(directory, filename)
+        for filename in storage.listdir(directory)[1]
+    }
+    names -= set(StoredImage.objects.filter(
+        name__in=names).values_list('name', flat=True))
+    names -= set(Recipe.objects.filter(
+        image__in=names).values_list('image', flat=True))
+    if fix:
+        for name in names:
+            with transaction.atomic():
+                lock_image(name)
+                release_image(name)
+    return len(names)
+
+
+def release_image(name):
+    """Удаляет файл с миниатюрами, когда на него не ссылаются рецепты.
+
+    Вызывается после фиксации транзакции, которая убрала ссылку.
+    Решение принимается под блокировкой записи файла: загрузка того же
+    файла держит её до фиксации своего рецепта. Файл без записи не
+    удаляется - на него могут ссылаться рецепты из bulk_create.
+    """
+    if not name:
+        return False
+    with transaction.atomic():
+        image = StoredImage.objects.select_for_update().filter(
+            name=name, references=0).first()
+        if image is None:
+            return False
+        image.delete()
+        storage = get_storage()
+        for path in (name, *variant_paths(name)):
+            storage.delete(path)
+    return True
@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand
+
+from reviews.images import update_image_variants
+from reviews.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Собирает миниатюры изображений рецептов, '
+            'у которых их ещё нет или они устарели.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересобрать миниатюры всех рецептов.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_variants').order_by('id')
+        built = failed = 0
+        for recipe in recipes.iterator():
+            if (not options['all'] and recipe.image_variants.get('source')
+                    == recipe.image.name):
+                continue
+            if update_image_variants(recipe, force=options['all']):
+                built += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Собраны миниатюры рецептов: {built}'))
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'Не удалось собрать: {failed}'))
@@ -0,0 +1,199 @@
+import itertools
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from api.cache import bump_version
+from api.ingredient_index import build_index
+from reviews.constants import PLACEHOLDER_IMAGE
+from reviews.cart import rebuild_cart_totals
+from reviews.counters import reconcile_counters
+from reviews.models import (Favorite, Ingredient, IngredientRecipes, Recipe,
+                            ShoppingList, Tag)
+from users.models import Follow, User
+
+
+def zipf_weights(size, exponent):
+    """Накопленные веса распределения Ципфа для size элементов."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует синтетических пользователей, рецепты, избранное, '
+        'списки покупок и подписки для нагрузочного тестирования.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='Сколько ингредиентов создать, если '
+                                 'справочник пуст.')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8,
+                            help='Максимум ингредиентов в рецепте.')
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--carts', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Показатель распределения Ципфа для '
+                                 'популярности авторов и рецептов.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--password', default='password')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        self.started = time.monotonic()
+        with transaction.atomic():
+            user_ids = self.create_users(
+                options['users'], options['password'])
+            tag_ids = self.create_tags(options['tags'])
+            ingredient_ids = self.get_ingredients(options['ingredients'])
+            recipe_ids = self.create_recipes(options['recipes'], user_ids)
+            self.create_recipe_links(
+                recipe_ids, tag_ids, ingredient_ids,
+                options['ingredients_per_recipe'])
+            for model, count in ((Favorite, options['favorites']),
+                                 (ShoppingList, options['carts'])):
+                self.create_recipe_users(model, count, user_ids, recipe_ids)
+            self.create_follows(options['follows'], user_ids)
+            self.log('Пересчёт счётчиков и списков покупок')
+            reconcile_counters()
+            rebuild_cart_totals()
+            transaction.on_commit(lambda: bump_version('recipes'))
+        self.stdout.write(self.style.SUCCESS('Данные сгенерированы'))
+
+    def log(self, message):
+        self.stdout.write(
+            f'[{time.monotonic() - self.started:8.1f} с] {message}')
+
+    def bulk_create(self, model, objects, ignore_conflicts=False,
+                    label=None):
+        """Пишет объекты пачками, не держа их все в памяти."""
+        created = 0
+        for chunk in chunked(objects, self.batch_size):
+            model.objects.bulk_create(
+                chunk, batch_size=self.batch_size,
+                ignore_conflicts=ignore_conflicts)
+            created += len(chunk)
+        self.log(f'{label or model._meta.verbose_name_plural}: {created}')
+
+    @staticmethod
+    def get_last_id(model):
+        return model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+    def new_ids(self, model, last_id):
+        """id строк, созданных после last_id.
+
+        SQLite не возвращает первичные ключи из bulk_create.
+        """
+        return list(model.objects.filter(id__gt=last_id).order_by(
+            'id').values_list('id', flat=True))
+
+    def zipf_choices(self, population, count):
+        return self.random.choices(
+            population, cum_weights=zipf_weights(len(population), self.skew),
+            k=count)
+
+    def create_users(self, count, password):
+        last_id = self.get_last_id(User)
+        password = make_password(password)
+        self.bulk_create(User, (
+            User(email=f'user{index}@example.com',
+                 username=f'user{index}', first_name='Имя',
+                 last_name='Фамилия', password=password)
+            for index in range(last_id + 1, last_id + count + 1)
+        ))
+        return self.new_ids(User, last_id)
+
+    def create_tags(self, count):
+        existing = Tag.objects.count()
+        self.bulk_create(Tag, (
+            Tag(name=f'Тег {index}', slug=f'tag-{index}',
+                color=f'#{self.random.randrange(0x1000000):06X}')
+            for index in range(existing, count)
+        ))
+        transaction.on_commit(lambda: bump_version('tags'))
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def get_ingredients(self, count):
+        if not Ingredient.objects.exists():
+            self.bulk_create(Ingredient, (
+                Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+                for index in range(count)
+            ))
+            transaction.on_commit(build_index)
+            transaction.on_commit(lambda: bump_version('ingredients'))
+        return list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, count, user_ids):
+        last_id = self.get_last_id(Recipe)
+        image = Recipe.image.field.storage.save(
+            'recipes/generated.png', ContentFile(PLACEHOLDER_IMAGE))
+        authors = self.zipf_choices(user_ids, count)
+        self.bulk_create(Recipe, (
+            Recipe(author_id=author_id, name=f'Рецепт {index}',
+                   text=f'Описание рецепта {index}', image=image,
+                   cooking_time=self.random.randint(1, 180))
+            for index, author_id in enumerate(authors, start=last_id + 1)
+        ))
+        return self.new_ids(Recipe, last_id)
+
+    def create_recipe_links(self, recipe_ids, tag_ids, ingredient_ids,
+                            ingredients_per_recipe):
+        weights = zipf_weights(len(ingredient_ids), self.skew)
+
+        def tags():
+            for recipe_id in recipe_ids:
+                for tag_id in self.random.sample(
+                        tag_ids, self.random.randint(1, min(3, len(tag_ids)))):
+                    yield Recipe.tags.through(
+                        recipe_id=recipe_id, tag_id=tag_id)
+
+        def ingredients():
+            for recipe_id in recipe_ids:
+                chosen = set(self.random.choices(
+                    ingredient_ids, cum_weights=weights,
+                    k=self.random.randint(1, ingredients_per_recipe)))
+                for ingredient_id in chosen:
+                    yield IngredientRecipes(
+                        recipe_id=recipe_id, ingredient_id=ingredient_id,
+                        amount=self.random.randint(1, 1000))
+
+        self.bulk_create(Recipe.tags.through, tags(), label='Теги рецептов')
+        self.bulk_create(IngredientRecipes, ingredients())
+
+    def create_recipe_users(self, model, count, user_ids, recipe_ids):
+        """Избранное и списки покупок: популярные рецепты встречаются чаще."""
+        recipes = self.zipf_choices(recipe_ids, count)
+        self.bulk_create(model, (
+            model(user_id=self.random.choice(user_ids), recipe_id=recipe_id)
+            for recipe_id in recipes
+        ), ignore_conflicts=True)
+
+    def create_follows(self, count, user_ids):
+        authors = self.zipf_choices(user_ids, count)
+        self.bulk_create(Follow, (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in (
+                (self.random.choice(user_ids), author_id)
+                for author_id in authors)
+            if user_id != author_id
+        ), ignore_conflicts=True)
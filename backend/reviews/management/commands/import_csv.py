@@ -1,42 +1,166 @@
 import csv
+import json
+import re
+from pathlib import Path
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
+from api.cache import bump_version
+from api.ingredient_index import build_index
 from reviews.models import Ingredient, Tag
 
+INGREDIENT_FIELDS = ('name', 'measurement_unit')
+TAG_FIELDS = ('name', 'color', 'slug')
+
+
+WHITESPACE = re.compile(r'\s*')
+
+
+def iter_json_items(file, chunk_size=64 * 1024):
+    """Элементы JSON-списка по одному; файл читается кусками."""
+    decoder = json.JSONDecoder()
+    buffer, position = '', 0
+
+    def read_more():
+        nonlocal buffer, position
+        chunk = file.read(chunk_size)
+        buffer, position = buffer[position:] + chunk, 0
+        return bool(chunk)
+
+    # '[' - начало списка, 'first' - элемент или ']', ',' - запятая
+    # или ']', 'item' - элемент после запятой.
+    expected = '['
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if not read_more():
+                raise ValueError('JSON-список не закончен')
+            continue
+        char = buffer[position]
+        if expected == '[':
+            if char != '[':
+                raise ValueError('ожидался JSON-список')
+            position += 1
+            expected = 'first'
+            continue
+        if char == ']' and expected in ('first', ','):
+            return
+        if expected == ',':
+            if char != ',':
+                raise ValueError('ожидалась запятая между элементами')
+            position += 1
+            expected = 'item'
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if read_more():
+                continue
+            raise
+        if end == len(buffer) and read_more():
+            # Элемент мог оборваться на границе куска.
+            continue
+        yield item
+        position = end
+        expected = ','
+
+
+def read_rows(path, fields):
+    """Построчно читает CSV или JSON-список объектов."""
+    with open(path, encoding='utf-8') as file:
+        if Path(path).suffix.lower() == '.json':
+            for item in iter_json_items(file):
+                if not isinstance(item, dict):
+                    raise ValueError('элемент списка - не объект')
+                yield tuple(item.get(field) for field in fields)
+        else:
+            yield from csv.reader(file)
+
 
 class Command(BaseCommand):
-    def import_ingredients(self):
+    help = 'Загружает справочники ингредиентов и тегов из CSV или JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', default='./data/ingredients.csv',
+                            help='Путь к CSV или JSON с ингредиентами.')
+        parser.add_argument('--tags', default='./data/tags.csv',
+                            help='Путь к CSV или JSON с тегами.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    @staticmethod
+    def is_valid(row, max_lengths):
+        return len(row) == len(max_lengths) and all(
+            isinstance(value, str) and 0 < len(value) <= max_length
+            for value, max_length in zip(row, max_lengths)
+        )
+
+    def load(self, model, path, fields, unique_keys, batch_size):
+        """Добавляет в таблицу только новые строки файла.
+
+        unique_keys - функции, возвращающие значения уникальных ограничений
+        модели; по ним строки сверяются с базой и друг с другом в памяти.
+        """
+        max_lengths = [
+            model._meta.get_field(field).max_length for field in fields]
+        seen = [
+            set(map(key, model.objects.values_list(*fields)))
+            for key in unique_keys
+        ]
+        before = model.objects.count()
+        skipped = failed = 0
+        batch = []
         try:
-            with open('./data/ingredients.csv', encoding='utf-8') as csvfile:
-                reader = csv.reader(csvfile)
-                for name, measurement_unit in reader:
-                    Ingredient.objects.get_or_create(
-                        name=name, measurement_unit=measurement_unit
-                    )
+            rows = read_rows(path, fields)
+            with transaction.atomic():
+                for row in rows:
+                    row = tuple(value.strip() if isinstance(value, str)
+                                else value for value in row)
+                    if not self.is_valid(row, max_lengths):
+                        failed += 1
+                        continue
+                    keys = [key(row) for key in unique_keys]
+                    if any(key in known for key, known in zip(keys, seen)):
+                        skipped += 1
+                        continue
+                    for key, known in zip(keys, seen):
+                        known.add(key)
+                    batch.append(model(**dict(zip(fields, row))))
+                    if len(batch) >= batch_size:
+                        model.objects.bulk_create(
+                            batch, ignore_conflicts=True)
+                        batch = []
+                model.objects.bulk_create(batch, ignore_conflicts=True)
         except FileNotFoundError:
-            self.stdout.write(self.style.SUCCESS(
-                'Файл не найден. Убедитесь, что путь к файлу верный.'
-            )
+            raise CommandError(
+                f'Файл {path} не найден. Убедитесь, что путь к файлу верный.'
             )
+        except (ValueError, csv.Error) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        # ignore_conflicts молча пропускает строки, которые успели
+        # добавить параллельно, поэтому считаем по таблице.
+        inserted = model.objects.count() - before
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: добавлено {inserted}, '
+            f'пропущено {skipped}, с ошибками {failed}'
+        )
+        return inserted
 
-    def import_tags(self):
-        try:
-            with open('./data/tags.csv', encoding='utf-8') as csvfile:
-                reader = csv.reader(csvfile)
-                for name, color, slug in reader:
-                    Tag.objects.get_or_create(
-                        name=name,
-                        color=color,
-                        slug=slug
-                    )
-        except FileExistsError:
-            self.stdout.write(self.style.SUCCESS(
-                'Файл не найден. Убедитесь, что путь к файлу верный.'
-            )
-            )
+    def import_ingredients(self, path, batch_size):
+        if self.load(
+                Ingredient, path, INGREDIENT_FIELDS, (tuple,), batch_size):
+            build_index()
+            bump_version('ingredients')
+
+    def import_tags(self, path, batch_size):
+        if self.load(
+            Tag, path, TAG_FIELDS,
+            (lambda row: row[0], lambda row: row[2]),
+            batch_size
+        ):
+            bump_version('tags')
 
     def handle(self, *args, **options):
-        self.import_ingredients()
-        self.import_tags()
+        self.import_ingredients(options['ingredients'], options['batch_size'])
+        self.import_tags(options['tags'], options['batch_size'])
         self.stdout.write(self.style.SUCCESS('Данные импортированы'))
@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from reviews.cart import rebuild_cart_totals
+
+
+class Command(BaseCommand):
+    help = ('Сверяет итоги списков покупок с подсчётом по рецептам '
+            'и пересобирает разошедшиеся.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не меняя.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user_ids = rebuild_cart_totals(fix=not options['dry_run'])
+        if not user_ids:
+            self.stdout.write(self.style.SUCCESS('Итоги сходятся'))
+            return
+        self.stdout.write(
+            f'Расхождения у пользователей: {len(user_ids)} '
+            f'(id: {", ".join(map(str, sorted(user_ids)[:20]))})')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Итоги не исправлены'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Итоги пересобраны'))
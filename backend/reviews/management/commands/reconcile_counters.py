@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from reviews.counters import reconcile_counters
+from reviews.images import register_images, sweep_images
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счётчики рецептов и пользователей и чинит расхождения.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не меняя.')
+
+    def handle(self, *args, **options):
+        fix = not options['dry_run']
+        with transaction.atomic():
+            drift = {
+                'reviews.StoredImage': register_images(fix=fix),
+                **reconcile_counters(fix=fix),
+            }
+        # Вне общей транзакции: файлы удаляются только вместе с записями.
+        drift['reviews.Recipe.image'] = sweep_images(fix=fix)
+        for counter, count in drift.items():
+            self.stdout.write(f'{counter}: расхождений {count}')
+        if not any(drift.values()):
+            self.stdout.write(self.style.SUCCESS('Счётчики сходятся'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING('Счётчики не исправлены'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Счётчики исправлены'))
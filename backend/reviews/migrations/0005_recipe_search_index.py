@@ -0,0 +1,89 @@
+from django.db import migrations
+
+# SQL на момент миграции: reviews.search может меняться дальше.
+POSTGRES_CREATE = (
+    """
+    ALTER TABLE reviews_recipe ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(text, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX reviews_recipe_search_vector '
+    'ON reviews_recipe USING GIN (search_vector)',
+)
+POSTGRES_DROP = (
+    'ALTER TABLE reviews_recipe DROP COLUMN search_vector',
+)
+
+SQLITE_CREATE = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS reviews_recipe_fts USING fts5(
+        name, text, content='reviews_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reviews_recipe_fts_insert
+    AFTER INSERT ON reviews_recipe BEGIN
+        INSERT INTO reviews_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reviews_recipe_fts_delete
+    AFTER DELETE ON reviews_recipe BEGIN
+        INSERT INTO reviews_recipe_fts(reviews_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reviews_recipe_fts_update
+    AFTER UPDATE OF name, text ON reviews_recipe BEGIN
+        INSERT INTO reviews_recipe_fts(reviews_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO reviews_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    "INSERT INTO reviews_recipe_fts(reviews_recipe_fts) VALUES ('rebuild')",
+)
+SQLITE_DROP = (
+    'DROP TRIGGER IF EXISTS reviews_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS reviews_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS reviews_recipe_fts_update',
+    'DROP TABLE IF EXISTS reviews_recipe_fts',
+)
+
+
+def execute(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_CREATE)
+    elif vendor == 'sqlite':
+        execute(schema_editor, SQLITE_CREATE)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        execute(schema_editor, POSTGRES_DROP)
+    elif vendor == 'sqlite':
+        execute(schema_editor, SQLITE_DROP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0004_auto_20240401_1043'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
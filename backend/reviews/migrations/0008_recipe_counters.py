@@ -0,0 +1,46 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Счётчик, модель связей и поле связей, указывающее на владельца счётчика.
+COUNTERS = (
+    ('reviews.Recipe', 'favorites_count', 'reviews.Favorite', 'recipe'),
+    ('reviews.Recipe', 'in_carts_count', 'reviews.ShoppingList', 'recipe'),
+    ('users.User', 'recipes_count', 'reviews.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+    ('users.User', 'following_count', 'users.Follow', 'user'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for label, field, related_label, related_field in COUNTERS:
+        counts = apps.get_model(related_label).objects.filter(
+            **{related_field: OuterRef('pk')}
+        ).order_by().values(related_field).annotate(
+            count=Count('pk')).values('count')
+        apps.get_model(label).objects.update(
+            **{field: Coalesce(Subquery(counts), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_counters'),
+        ('reviews', '0007_recipe_keyset_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в списки покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
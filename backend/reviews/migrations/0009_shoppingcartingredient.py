@@ -0,0 +1,54 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:30
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def fill_cart_totals(apps, schema_editor):
+    """Итоги по ингредиентам из списков покупок и состава рецептов."""
+    totals = apps.get_model('reviews', 'ShoppingCartIngredient')
+    rows = apps.get_model('reviews', 'IngredientRecipes').objects.filter(
+        recipe__shopping_list__isnull=False
+    ).values('recipe__shopping_list__user', 'ingredient').annotate(
+        total_amount=Sum('amount'), recipe_count=Count('recipe')
+    ).order_by()
+    totals.objects.bulk_create(
+        totals(user_id=row['recipe__shopping_list__user'],
+               ingredient_id=row['ingredient'],
+               total_amount=row['total_amount'],
+               recipe_count=row['recipe_count'])
+        for row in rows.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reviews', '0008_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('recipe_count', models.PositiveIntegerField(default=0, verbose_name='Количество рецептов')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to='reviews.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент списка покупок',
+                'verbose_name_plural': 'Ингредиенты списков покупок',
+                'default_related_name': 'cart_ingredients',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_ingredient'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 18:40
+
+from django.db import migrations, models
+import reviews.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0010_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(help_text='Прикрепите фото рецепта', storage=reviews.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Изображение'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:08
+
+from django.db import migrations, models
+from django.db.models import Count
+import reviews.storage
+
+
+def fill_stored_images(apps, schema_editor):
+    """Записи для файлов существующих рецептов с числом ссылок."""
+    model = apps.get_model('reviews', 'StoredImage')
+    rows = apps.get_model('reviews', 'Recipe').objects.exclude(
+        image=''
+    ).values('image').annotate(references=Count('pk')).order_by()
+    model.objects.bulk_create(
+        model(name=row['image'], references=row['references'])
+        for row in rows.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0011_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Файл')),
+                ('references', models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов с файлом')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, help_text='Прикрепите фото рецепта', storage=reviews.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Изображение'),
+        ),
+        migrations.RunPython(fill_stored_images, migrations.RunPython.noop),
+    ]
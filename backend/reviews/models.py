@@ -2,10 +2,11 @@ from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from colorfield.fields import ColorField
 
-from users.models import User
+from users.models import CounterModel, User
 from .constants import (
     MEDIUM_LENGTH, MAX_COLOR, MIN, MAX
 )
+from .storage import ContentAddressedStorage
 
 
 class Tag(models.Model):
@@ -56,7 +57,7 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(CounterModel):
     """Рецепты."""
 
     author = models.ForeignKey(
@@ -72,7 +73,14 @@ class Recipe(models.Model):
     image = models.ImageField(
         verbose_name='Изображение',
         upload_to='recipes/',
+        storage=ContentAddressedStorage(),
+        db_index=True,
         help_text='Прикрепите фото рецепта')
+    image_variants = models.JSONField(
+        verbose_name='Миниатюры',
+        default=dict,
+        blank=True,
+        editable=False)
     text = models.TextField(
         verbose_name='Описание рецепта',
         help_text='Введите описание рецепта')
@@ -103,11 +111,34 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации',
         auto_now_add=True)
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True)
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлено в избранное',
+        default=0,
+        editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='Добавлено в списки покупок',
+        default=0,
+        editable=False)
+
+    counter_fields = ('favorites_count', 'in_carts_count')
+    # Файл изображения на момент загрузки из базы: после замены старый
+    # файл удаляется, если на него больше никто не ссылается.
+    loaded_image_name = None
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            )
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=('author', 'name'),
@@ -118,8 +149,39 @@ class Recipe(models.Model):
     def __str__(self):
         return f'{self.author} - {self.name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        recipe = super().from_db(db, field_names, values)
+        recipe.loaded_image_name = recipe.__dict__.get('image')
+        return recipe
+
+
+class StoredImage(models.Model):
+    """Файл изображения и число рецептов, которые на него ссылаются.
+
+    Файлы называются по содержимому и общие у рецептов с одинаковым
+    фото. Число ссылок меняется в транзакции записи рецепта, а решение
+    удалить файл принимается под блокировкой этой строки.
+    """
+
+    name = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='Файл')
+    references = models.PositiveIntegerField(
+        verbose_name='Рецептов с файлом',
+        default=0,
+        editable=False)
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
 
-class IngredientRecipes(models.Model):
+    def __str__(self):
+        return self.name
+
+
+class IngredientRecipes(CounterModel):
     """Связь между ингредиентами и рецептами."""
 
     amount = models.PositiveSmallIntegerField(
@@ -158,7 +220,7 @@ class IngredientRecipes(models.Model):
         return f'{self.ingredient} в {self.recipe}'
 
 
-class RecipUserBase(models.Model):
+class RecipUserBase(CounterModel):
     """Абстрактный класс для моделей избранных и список покупок."""
 
     user = models.ForeignKey(
@@ -205,3 +267,40 @@ class ShoppingList(RecipUserBase):
                 name='unique_recipe'
             ),
         ]
+
+
+class ShoppingCartIngredient(models.Model):
+    """Итог по ингредиенту в списке покупок пользователя.
+
+    Обновляется при изменении списка покупок и состава рецептов в нём,
+    чтобы выгрузка не пересчитывала сумму по всем рецептам.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент')
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+        default=0)
+    recipe_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0)
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списков покупок'
+        default_related_name = 'cart_ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient}: {self.total_amount} у {self.user}'
@@ -0,0 +1,137 @@
+"""Полнотекстовый поиск по названию и описанию рецептов.
+
+В PostgreSQL это вычисляемая колонка tsvector с GIN-индексом, в SQLite -
+таблица FTS5 с внешним содержимым, которую синхронизируют триггеры.
+В обоих случаях индекс обновляет сама база при любой записи в рецепты.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+RECIPE_TABLE = 'reviews_recipe'
+FTS_TABLE = 'reviews_recipe_fts'
+
+POSTGRES_CREATE = (
+    f"""
+    ALTER TABLE {RECIPE_TABLE} ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(text, '')), 'B')
+    ) STORED
+    """,
+    f'CREATE INDEX {RECIPE_TABLE}_search_vector '
+    f'ON {RECIPE_TABLE} USING GIN (search_vector)',
+)
+POSTGRES_DROP = (
+    f'ALTER TABLE {RECIPE_TABLE} DROP COLUMN search_vector',
+)
+
+SQLITE_CREATE = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, text, content='{RECIPE_TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+)
+SQLITE_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON {RECIPE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON {RECIPE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF name, text ON {RECIPE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+)
+SQLITE_REBUILD = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+SQLITE_DROP = (
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+)
+
+
+def _execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_search_index(connection):
+    if connection.vendor == 'postgresql':
+        _execute(connection, POSTGRES_CREATE)
+    elif connection.vendor == 'sqlite':
+        _execute(connection, SQLITE_CREATE + SQLITE_TRIGGERS)
+        _execute(connection, (SQLITE_REBUILD,))
+
+
+def drop_search_index(connection):
+    if connection.vendor == 'postgresql':
+        _execute(connection, POSTGRES_DROP)
+    elif connection.vendor == 'sqlite':
+        _execute(connection, SQLITE_DROP)
+
+
+def ensure_search_triggers(using, **kwargs):
+    """Восстанавливает триггеры FTS5 после миграций.
+
+    SQLite меняет схему, пересоздавая таблицу, и триггеры рецептов при
+    этом удаляются. Вызывается по сигналу post_migrate.
+    """
+    connection = connections[using]
+    if (connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()):
+        _execute(connection, SQLITE_TRIGGERS)
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, от более релевантных к менее."""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        queryset = queryset.filter(RawSQL(
+            f'{RECIPE_TABLE}.search_vector @@ {tsquery}', (query,),
+            output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank({RECIPE_TABLE}.search_vector, {tsquery})', (query,),
+            output_field=FloatField()
+        ))
+    elif vendor == 'sqlite':
+        # Таблица FTS5 присоединяется к рецептам, чтобы MATCH и bm25()
+        # считались за один проход по индексу, а не для каждой строки.
+        match = ' '.join(f'"{word}"*' for word in words)
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {RECIPE_TABLE}.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'-bm25({FTS_TABLE}, 10.0, 1.0)'},
+        )
+    else:
+        for word in words:
+            queryset = queryset.filter(name__icontains=word)
+        return queryset
+    return queryset.order_by('-search_rank', *queryset.model._meta.ordering)
@@ -0,0 +1,186 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import Follow, User
+from .cart import change_cart_recipes, change_recipe_ingredients
+from .counters import change_counters
+from .images import (change_image_references, release_image,
+                     update_image_variants)
+from .models import Favorite, IngredientRecipes, Recipe, ShoppingList
+
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingList: 'in_carts_count',
+}
+
+_state = threading.local()
+
+
+@contextmanager
+def muted_signals():
+    """Обработчики счётчиков и кэшей молчат в этом потоке.
+
+    Для пакетных изменений: вызывающий код сам обновляет всё одним
+    запросом на пачку вместо запроса на каждую запись.
+    """
+    _state.muted = True
+    try:
+        yield
+    finally:
+        _state.muted = False
+
+
+def skip_when_muted(handler):
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not getattr(_state, 'muted', False):
+            return handler(*args, **kwargs)
+    return wrapper
+
+
+def touch_recipes(**filters):
+    """Отмечает рецепты изменёнными, не вызывая их save()."""
+    Recipe.objects.filter(**filters).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=IngredientRecipes)
+@receiver(post_delete, sender=IngredientRecipes)
+@skip_when_muted
+def touch_recipe_on_ingredients_change(instance, **kwargs):
+    touch_recipes(pk=instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@skip_when_muted
+def touch_recipe_on_tags_change(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_recipes(pk=instance.pk)
+    elif pk_set:
+        touch_recipes(pk__in=pk_set)
+
+
+@receiver(post_save, sender=User)
+def touch_recipes_on_author_change(instance, created, update_fields,
+                                   **kwargs):
+    """Данные автора входят в ответ по каждому его рецепту."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    touch_recipes(author=instance)
+
+
+def update_counters(instance, created, counters):
+    """Сдвигает счётчики в той же транзакции, что и сама запись.
+
+    created равен None для удаления и False для изменения записи, которое
+    на счётчики не влияет. counters - тройки (модель, поле с id владельца,
+    поле счётчика).
+    """
+    if created is False:
+        return
+    delta = 1 if created else -1
+    for model, owner_field, field in counters:
+        change_counters(
+            model, (getattr(instance, owner_field),), field, delta)
+
+
+def recipe_links_changed(model, user_id, recipe_ids, added):
+    """Избранное или список покупок пользователя пополнились рецептами
+    recipe_ids (added) или лишились их: счётчики и итоги по ингредиентам.
+    """
+    change_counters(
+        Recipe, recipe_ids, RECIPE_COUNTERS[model], 1 if added else -1)
+    if model is ShoppingList:
+        change_cart_recipes(user_id, recipe_ids, added)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+@skip_when_muted
+def update_recipe_link_counters(sender, instance, created=None, **kwargs):
+    if created is not False:
+        recipe_links_changed(
+            sender, instance.user_id, (instance.recipe_id,), created)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipes_count(instance, created=None, **kwargs):
+    update_counters(instance, created, (
+        (User, 'author_id', 'recipes_count'),))
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_variants(instance, **kwargs):
+    """Миниатюры собираются после фиксации, вне транзакции рецепта."""
+    name = instance.image.name
+    if name and instance.image_variants.get('source') != name:
+        transaction.on_commit(lambda: update_image_variants(instance))
+    previous = instance.loaded_image_name
+    if previous != name:
+        change_image_references(name, 1)
+        if previous:
+            change_image_references(previous, -1)
+            transaction.on_commit(lambda: release_image(previous))
+    instance.loaded_image_name = name
+
+
+@receiver(post_delete, sender=Recipe)
+def schedule_image_release(instance, **kwargs):
+    name = instance.image.name
+    change_image_references(name, -1)
+    transaction.on_commit(lambda: release_image(name))
+
+
+def follows_changed(user_id, author_ids, added):
+    """Пользователь подписался на авторов author_ids (added) или отписался."""
+    delta = 1 if added else -1
+    change_counters(User, author_ids, 'followers_count', delta)
+    change_counters(
+        User, (user_id,), 'following_count', delta * len(author_ids))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+@skip_when_muted
+def update_follow_counts(instance, created=None, **kwargs):
+    if created is not False:
+        follows_changed(instance.user_id, (instance.author_id,), created)
+
+
+@receiver(pre_save, sender=IngredientRecipes)
+@skip_when_muted
+def remember_recipe_ingredient(instance, **kwargs):
+    """Прежние ингредиент и количество нужно вычесть из итогов."""
+    instance.previous_item = None
+    if not instance._state.adding:
+        instance.previous_item = IngredientRecipes.objects.filter(
+            pk=instance.pk).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipes)
+@skip_when_muted
+def update_cart_totals_on_ingredient_save(instance, **kwargs):
+    previous = getattr(instance, 'previous_item', None)
+    change_recipe_ingredients(
+        instance.recipe_id,
+        added=((instance.ingredient_id, instance.amount),),
+        removed=(previous,) if previous else ())
+
+
+@receiver(post_delete, sender=IngredientRecipes)
+@skip_when_muted
+def update_cart_totals_on_ingredient_delete(instance, **kwargs):
+    change_recipe_ingredients(
+        instance.recipe_id,
+        removed=((instance.ingredient_id, instance.amount),))
@@ -0,0 +1,48 @@
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файлы называются по sha256 содержимого.
+
+    Одинаковые изображения разных рецептов и повторные загрузки того же
+    файла занимают на диске одно место и не записываются заново.
+    Удалять такой файл можно только когда на него не ссылается ни одна
+    запись - см. reviews.images.release_image.
+    """
+
+    @staticmethod
+    def get_content_name(name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest.hexdigest() + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.generate_filename(self.get_content_name(name, content))
+        # Иначе файл, найденный save_as, может удалить release_image
+        # другого рецепта до того, как ссылка на него будет записана.
+        from .images import lock_image
+        lock_image(name)
+        return self.save_as(name, content)
+
+    def save_as(self, name, content):
+        """Пишет файл под именем name, если такого файла ещё нет.
+
+        Для производных файлов, имя которых задаётся хэшем исходного.
+        """
+        name = self.generate_filename(name)
+        if self.exists(name):
+            return name
+        return self._save(name, content)
@@ -0,0 +1,37 @@
+import pytest
+from django.core.cache import caches
+from rest_framework.test import APIClient
+
+from api.management.commands.benchmark_api import LOCMEM_CACHES, Command
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(settings, tmp_path):
+    """Файлы, индекс ингредиентов и кэш у каждого теста свои."""
+    settings.MEDIA_ROOT = tmp_path
+    settings.INGREDIENT_INDEX_PATH = tmp_path / 'ingredients.idx'
+    settings.CACHES = LOCMEM_CACHES
+    for cache in caches.all():
+        cache.clear()
+    yield
+    for cache in caches.all():
+        cache.clear()
+
+
+@pytest.fixture
+def data(db):
+    """Те же данные, что у benchmark_api, в уменьшенном объёме."""
+    return Command().seed(
+        {'users': 12, 'recipes': 60, 'ingredients_per_recipe': 4})
+
+
+@pytest.fixture
+def anonymous_client():
+    return APIClient()
+
+
+@pytest.fixture
+def user_client(data):
+    client = APIClient()
+    client.force_authenticate(data['user'])
+    return client
@@ -0,0 +1,64 @@
+import pytest
+
+from reviews.cart import rebuild_cart_totals
+from reviews.counters import reconcile_counters
+from reviews.models import Recipe
+
+
+def assert_counters_consistent():
+    assert not any(reconcile_counters(fix=False).values())
+    assert not rebuild_cart_totals(fix=False)
+
+
+@pytest.mark.parametrize('name, counter', (
+    ('favorite', 'favorites_count'),
+    ('shopping_cart', 'in_carts_count'),
+))
+def test_recipes_batch_repeated(name, counter, data, user_client):
+    recipe_ids = data['batch_recipes']
+    url = f'/api/recipes/{name}/'
+    before = dict(Recipe.objects.filter(
+        pk__in=recipe_ids).values_list('pk', counter))
+    for status in ('added', 'exists'):
+        response = user_client.post(
+            url, {'recipes': recipe_ids}, format='json')
+        assert response.status_code == 200
+        assert {item['status'] for item in response.data['recipes']} == {
+            status}
+        assert dict(Recipe.objects.filter(
+            pk__in=recipe_ids).values_list('pk', counter)) == {
+            pk: count + 1 for pk, count in before.items()}
+        assert_counters_consistent()
+    for status in ('removed', 'not_found'):
+        response = user_client.delete(
+            url, {'recipes': recipe_ids}, format='json')
+        assert response.status_code == 200
+        assert {item['status'] for item in response.data['recipes']} == {
+            status}
+        assert dict(Recipe.objects.filter(
+            pk__in=recipe_ids).values_list('pk', counter)) == before
+        assert_counters_consistent()
+
+
+def test_subscribe_batch_repeated(data, user_client):
+    user = data['user']
+    author_ids = data['batch_authors']
+    url = '/api/users/subscribe/'
+    for status in ('subscribed', 'exists'):
+        response = user_client.post(
+            url, {'authors': author_ids}, format='json')
+        assert response.status_code == 200
+        assert {item['status'] for item in response.data['authors']} == {
+            status}
+        assert_counters_consistent()
+    user.refresh_from_db()
+    following_count = user.following_count
+    for status in ('unsubscribed', 'not_found'):
+        response = user_client.delete(
+            url, {'authors': author_ids}, format='json')
+        assert response.status_code == 200
+        assert {item['status'] for item in response.data['authors']} == {
+            status}
+        assert_counters_consistent()
+    user.refresh_from_db()
+    assert user.following_count == following_count - len(author_ids)
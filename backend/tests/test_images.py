@@ -0,0 +1,146 @@
+import base64
+from io import BytesIO, StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db.models.signals import post_save
+from PIL import Image
+
+from reviews.images import release_image
+from reviews.models import Recipe, StoredImage
+
+
+GPS_IFD = 0x8825
+ORIENTATION = 0x0112
+
+
+def make_image(color, image_format='PNG', size=(64, 48), exif=None):
+    buffer = BytesIO()
+    params = {'exif': exif} if exif is not None else {}
+    Image.new('RGB', size, color).save(buffer, image_format, **params)
+    return f'data:image/{image_format.lower()};base64,' + base64.b64encode(
+        buffer.getvalue()).decode('ascii')
+
+
+def make_exif(orientation=1):
+    exif = Image.Exif()
+    exif[ORIENTATION] = orientation
+    exif[0x010F] = 'Camera'
+    exif.get_ifd(GPS_IFD).update({1: 'N', 2: (55.0, 45.0, 0.0)})
+    return exif
+
+
+@pytest.fixture
+def create_recipe(data, user_client, django_capture_on_commit_callbacks):
+    def create(name, image):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = user_client.post('/api/recipes/', {
+                'name': name,
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': image,
+                'tags': [data['tags'][0].pk],
+                'ingredients': [{'id': data['ingredient'], 'amount': 5}],
+            }, format='json')
+        assert response.status_code == 201, response.content
+        return Recipe.objects.get(pk=response.data['id'])
+    return create
+
+
+def delete_recipe(client, recipe, capture):
+    with capture(execute=True):
+        response = client.delete(f'/api/recipes/{recipe.pk}/')
+    assert response.status_code == 204
+
+
+def test_shared_image_deleted_with_last_reference(
+        create_recipe, user_client, django_capture_on_commit_callbacks):
+    image = make_image('red')
+    first = create_recipe('Первый', image)
+    second = create_recipe('Второй', image)
+    name = first.image.name
+    storage = Recipe.image.field.storage
+    assert second.image.name == name
+    assert StoredImage.objects.get(name=name).references == 2
+    delete_recipe(user_client, first, django_capture_on_commit_callbacks)
+    assert storage.exists(name)
+    assert StoredImage.objects.get(name=name).references == 1
+    delete_recipe(user_client, second, django_capture_on_commit_callbacks)
+    assert not storage.exists(name)
+    assert not StoredImage.objects.filter(name=name).exists()
+
+
+def test_release_after_reupload_keeps_file(
+        create_recipe, user_client, django_capture_on_commit_callbacks):
+    """Отложенное удаление не трогает файл, загруженный заново."""
+    image = make_image('blue')
+    first = create_recipe('Первый', image)
+    name = first.image.name
+    with django_capture_on_commit_callbacks() as callbacks:
+        user_client.delete(f'/api/recipes/{first.pk}/')
+    create_recipe('Второй', image)
+    for callback in callbacks:
+        callback()
+    assert not release_image(name)
+    assert Recipe.image.field.storage.exists(name)
+    assert StoredImage.objects.get(name=name).references == 1
+
+
+def test_failed_save_leaves_no_file(transactional_db, create_recipe,
+                                    user_client, data):
+    """Файл отката не удерживается: его убирает reconcile_counters."""
+    kept = create_recipe('Сохранённый', make_image('white')).image.name
+    storage = Recipe.image.field.storage
+    before = set(storage.listdir('recipes/')[1])
+
+    def fail(**kwargs):
+        raise IntegrityError('сбой после загрузки')
+
+    post_save.connect(fail, sender=Recipe, dispatch_uid='fail')
+    try:
+        with pytest.raises(IntegrityError):
+            user_client.post('/api/recipes/', {
+                'name': 'Несохранённый',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': make_image('black'),
+                'tags': [data['tags'][0].pk],
+                'ingredients': [{'id': data['ingredient'], 'amount': 5}],
+            }, format='json')
+    finally:
+        post_save.disconnect(sender=Recipe, dispatch_uid='fail')
+    leaked = set(storage.listdir('recipes/')[1]) - before
+    assert len(leaked) == 1
+    name = f'recipes/{leaked.pop()}'
+    assert not Recipe.objects.filter(name='Несохранённый').exists()
+    assert not StoredImage.objects.filter(name=name).exists()
+    call_command('reconcile_counters', stdout=StringIO())
+    assert not storage.exists(name)
+    assert not StoredImage.objects.filter(name=name).exists()
+    assert storage.exists(kept)
+    assert StoredImage.objects.get(name=kept).references == 1
+
+
+@pytest.mark.parametrize('orientation, size', ((1, (600, 300)),
+                                               (6, (300, 600))))
+@pytest.mark.parametrize('image_format', ('JPEG', 'PNG', 'WEBP'))
+def test_original_saved_without_metadata(image_format, orientation, size,
+                                         create_recipe):
+    recipe = create_recipe('С координатами', make_image(
+        'green', image_format, size=(600, 300), exif=make_exif(orientation)))
+    with recipe.image.open() as file, Image.open(file) as image:
+        assert image.format == image_format
+        assert not image.getexif()
+        assert 'exif' not in image.info
+        # Поворот из EXIF перенесён в пиксели.
+        assert image.size == size
+    recipe.refresh_from_db()
+    variants = recipe.image_variants
+    assert variants['source'] == recipe.image.name
+    for name, box in (('card', 480), ('thumbnail', 160)):
+        assert max(variants[name]['width'], variants[name]['height']) == box
+    storage = Recipe.image.field.storage
+    with storage.open(variants['thumbnail']['jpeg']) as file:
+        with Image.open(file) as image:
+            assert not image.getexif()
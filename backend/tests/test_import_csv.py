@@ -0,0 +1,41 @@
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+
+from reviews.management.commands.import_csv import iter_json_items
+from reviews.models import Ingredient
+
+ITEMS = [
+    {'name': 'соль', 'measurement_unit': 'г'},
+    {'name': 'мука [высший сорт], "экстра"', 'measurement_unit': 'г'},
+    {'name': 'вода', 'measurement_unit': 'мл', 'extra': [1, 2.5, None]},
+]
+
+
+@pytest.mark.parametrize('chunk_size', (1, 3, 7, 1024))
+@pytest.mark.parametrize('items', ([], [1234567], ITEMS))
+def test_iter_json_items(items, chunk_size):
+    text = json.dumps(items, ensure_ascii=False, indent=2)
+    assert list(iter_json_items(
+        io.StringIO(text), chunk_size=chunk_size)) == items
+
+
+@pytest.mark.parametrize('text', ('', '{}', '[1 2]', '[1,', '[{"a": 1}'))
+def test_iter_json_items_invalid(text):
+    with pytest.raises(ValueError):
+        list(iter_json_items(io.StringIO(text), chunk_size=2))
+
+
+def test_import_reports_real_inserted_count(db, tmp_path):
+    path = tmp_path / 'ingredients.json'
+    path.write_text(json.dumps(ITEMS[:2]), encoding='utf-8')
+    tags = tmp_path / 'tags.csv'
+    tags.write_text('', encoding='utf-8')
+    for inserted in (2, 0):
+        output = io.StringIO()
+        call_command('import_csv', ingredients=str(path), tags=str(tags),
+                     stdout=output)
+        assert f'добавлено {inserted},' in output.getvalue()
+    assert Ingredient.objects.count() == 2
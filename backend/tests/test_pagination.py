@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from api import pagination
+from reviews.models import Recipe
+
+PLAN = [{'Plan': {'Node Type': 'Seq Scan', 'Plan Rows': 1234}}]
+
+
+class FakeCursor:
+    """Курсор psycopg2: колонка json приходит уже разобранной."""
+
+    def __init__(self, row):
+        self.row = row
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    def __init__(self, row):
+        self.cursor_instance = FakeCursor(row)
+
+    def cursor(self):
+        return self.cursor_instance
+
+
+@pytest.mark.parametrize('plan', (PLAN, json.dumps(PLAN)))
+def test_estimate_count(plan, db, monkeypatch):
+    connection = FakeConnection((plan,))
+    monkeypatch.setattr(
+        pagination, 'connections', {'default': connection})
+    queryset = Recipe.objects.filter(name__icontains='суп')
+    assert pagination.estimate_count(queryset) == 1234
+    (sql, params), = connection.cursor_instance.executed
+    assert sql.startswith('EXPLAIN (FORMAT JSON) SELECT')
+    assert params == ('%суп%',)
+
+
+def test_search_count_follows_recipe_edits(
+        data, anonymous_client, django_capture_on_commit_callbacks):
+    url = '/api/recipes/?search=борщ'
+    assert anonymous_client.get(url).data['count'] == 0
+    recipe = data['recipe']
+    recipe.name = 'Борщ'
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe.save()
+    assert anonymous_client.get(url).data['count'] == 1
@@ -0,0 +1,72 @@
+"""Число запросов к базе на каждом маршруте API не выше бюджета.
+
+Бюджеты общие с командой benchmark_api (data/benchmark_budgets.json).
+Тесты транзакционные, как запросы в бою: иначе atomic() во вьюсетах
+добавит к счёту SAVEPOINT и RELEASE. Чтение замеряется повторным
+запросом, когда кэши count и справочников уже прогреты, как в бою.
+Отдельно проверяется порог времени в check_budgets.
+"""
+import io
+import json
+
+import pytest
+from django.core.management import CommandError
+
+from api.management.commands.benchmark_api import Command, load_budgets
+
+BUDGETS = load_budgets()
+LIMIT = 20
+
+
+def request(client, method, url, data=None):
+    return getattr(client, method)(url, data, format='json')
+
+
+def test_every_case_has_budget(data):
+    names = {case[0] for case in Command().get_cases(data, LIMIT)}
+    assert names == BUDGETS.keys()
+
+
+@pytest.mark.parametrize('name', sorted(BUDGETS))
+def test_queries_within_budget(name, transactional_db, data,
+                               anonymous_client, user_client,
+                               django_assert_max_num_queries):
+    cases = Command().get_cases(data, LIMIT)
+    index = next(
+        index for index, case in enumerate(cases) if case[0] == name)
+    _, method, url, authenticated, *body = cases[index]
+    client = user_client if authenticated else anonymous_client
+    if method == 'get':
+        request(client, method, url)
+    elif method == 'delete':
+        # Удаление идёт сразу за своим добавлением: сначала добавляем.
+        _, setup_method, setup_url, _, *setup_body = cases[index - 1]
+        request(client, setup_method, setup_url, *setup_body)
+    with django_assert_max_num_queries(BUDGETS[name]['queries']):
+        response = request(client, method, url, *body)
+        if response.streaming:
+            b''.join(response.streaming_content)
+    assert response.status_code < 400, response.content
+
+
+@pytest.mark.parametrize('time_ms, ok', ((10, True), (60, False)))
+def test_time_within_factor(tmp_path, time_ms, ok):
+    budgets = tmp_path / 'budgets.json'
+    budgets.write_text('{"case": {"queries": 3, "time": 4}}')
+    results = {'case': {'method': 'GET', 'url': '/api/', 'status': 200,
+                        'queries': 3, 'time_ms': time_ms}}
+    options = {
+        'budgets': budgets, 'report': tmp_path / 'report.json',
+        'time_factor': 3.0, 'update_budgets': False, 'users': 1,
+        'recipes': 1, 'ingredients_per_recipe': 1, 'limit': 1,
+        'read_limit': 1, 'repeat': 1,
+    }
+    command = Command(stdout=io.StringIO())
+    # Калибровка 2 мс: 10 мс - 5 единиц (x1.25), 60 мс - 30 (x7.5).
+    if ok:
+        command.check_budgets(results, {}, 2, options)
+    else:
+        with pytest.raises(CommandError, match='время'):
+            command.check_budgets(results, {}, 2, options)
+    report = json.loads((tmp_path / 'report.json').read_text())
+    assert report['results']['case']['time_ratio'] == time_ms / 8
@@ -0,0 +1,62 @@
+"""Список и карточка рецептов через values() совпадают с сериализатором."""
+import pytest
+
+from api.recipe_rows import RecipeRowsSerializer
+from reviews.images import update_image_variants
+from reviews.models import Recipe
+
+URLS = (
+    '/api/recipes/?limit=30',
+    '/api/recipes/?limit=30&page=2',
+    '/api/recipes/?limit=30&recipes_limit=2',
+    '/api/recipes/?limit=10&cursor=',
+    '/api/recipes/?limit=30&tags=breakfast&is_favorited=1',
+    '/api/recipes/?limit=30&is_in_shopping_cart=1',
+    '/api/recipes/?limit=30&search=рецепт',
+    '/api/recipes/{recipe}/',
+    '/api/recipes/{free_recipe}/',
+)
+
+
+@pytest.fixture
+def recipes_with_variants(data):
+    """Миниатюры есть только у части рецептов, как после загрузки."""
+    for recipe in Recipe.objects.order_by('-id')[:5]:
+        assert update_image_variants(recipe)
+    return data
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('authenticated', (False, True))
+def test_fast_read_matches_serializer(url, authenticated,
+                                      recipes_with_variants, settings,
+                                      anonymous_client, user_client):
+    data = recipes_with_variants
+    client = user_client if authenticated else anonymous_client
+    url = url.format(recipe=data['recipe'].pk,
+                     free_recipe=data['free_recipe'].pk)
+    responses = []
+    for fast in (False, True):
+        settings.RECIPES_FAST_READ = fast
+        response = client.get(url)
+        assert response.status_code == 200
+        responses.append(response.content)
+    assert responses[0] == responses[1]
+
+
+@pytest.mark.parametrize('fast', (False, True))
+@pytest.mark.parametrize('pk', ('0', 'abc'))
+def test_recipe_not_found(pk, fast, data, settings, anonymous_client):
+    settings.RECIPES_FAST_READ = fast
+    assert anonymous_client.get(f'/api/recipes/{pk}/').status_code == 404
+
+
+def test_fast_read_errors_propagate(data, settings, anonymous_client,
+                                    monkeypatch):
+    def broken(self, rows):
+        raise ValueError('расхождение с сериализатором')
+
+    settings.RECIPES_FAST_READ = True
+    monkeypatch.setattr(RecipeRowsSerializer, 'to_representation', broken)
+    with pytest.raises(ValueError):
+        anonymous_client.get(f'/api/recipes/{data["recipe"].pk}/')
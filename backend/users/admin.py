@@ -2,7 +2,6 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
 
-from reviews.models import Recipe
 from .models import Follow, User
 
 
@@ -13,8 +12,8 @@ class UserAdmin(UserAdmin):
         'email',
         'first_name',
         'last_name',
-        'get_follow_count',
-        'get_recipe_count'
+        'followers_count',
+        'recipes_count'
     )
     list_editable = (
         'email',
@@ -26,19 +25,20 @@ class UserAdmin(UserAdmin):
         'username'
     )
     list_filter = (
-        'email',
-        'username'
+        'is_staff',
+        'is_active'
     )
+    show_full_result_count = False
 
-    @admin.display(description='Количество подписчиков')
-    def get_follow_count(self, obj):
-        return Follow.objects.filter(user=obj).count()
 
-    @admin.display(description='Количество рецептов')
-    def get_recipe_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+@admin.register(Follow)
+class FollowAdmin(admin.ModelAdmin):
+    list_display = ('user', 'author')
+    list_select_related = ('user', 'author')
+    search_fields = ('user__username', 'author__username')
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
 
 
-admin.site.register(Follow)
 admin.site.unregister(Group)
 admin.site.empty_value_display = 'Не задано'
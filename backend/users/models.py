@@ -1,12 +1,40 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, router, transaction
 from django.db.models import F, Q
 from django.core.validators import RegexValidator
 
 from .constants import MAX_LENGTH_EMAIL, LENGHT_FIELDS
 
 
-class User(AbstractUser):
+class CounterModel(models.Model):
+    """Модель, которая хранит счётчики или влияет на чужие.
+
+    Сохранение идёт в транзакции, поэтому счётчики, которые обновляются
+    в post_save, меняются вместе с самой записью. Обычный save()
+    существующей записи не перезаписывает counter_fields устаревшими
+    значениями из памяти.
+    """
+
+    counter_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if (self.counter_fields and not self._state.adding
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class User(CounterModel, AbstractUser):
     """Модель пользоветеля."""
 
     USERNAME_FIELD = 'email'
@@ -32,6 +60,20 @@ class User(AbstractUser):
         max_length=LENGHT_FIELDS, blank=True,
         verbose_name='Фамилия пользователя',
         help_text='Укажите фамилию пользователя')
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False)
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False)
+    following_count = models.PositiveIntegerField(
+        verbose_name='Количество подписок',
+        default=0,
+        editable=False)
+
+    counter_fields = ('recipes_count', 'followers_count', 'following_count')
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -42,7 +84,7 @@ class User(AbstractUser):
         return self.username
 
 
-class Follow(models.Model):
+class Follow(CounterModel):
     """Модель подписок."""
 
     user = models.ForeignKey(